@@ -2,6 +2,11 @@ import argparse
 import os
 import sys
 
+import numpy as np
+
+from orderings import add_ordering_arguments, selected_orderings
+from score_matrix import write_score_matrix
+
 parser = argparse.ArgumentParser(description="Compile sentence scores across "
     "splits into one file for each grammar")
 
@@ -11,10 +16,18 @@ parser.add_argument("-f", "--file_location", type=str, required=True,
 parser.add_argument("-O", "--output_folder", type=str, required=True,
     help="Location of output folder")
 
+parser.add_argument("--format", type=str, choices=["txt", "npy"],
+    default="txt", help="Write one text file per grammar, or one "
+    "(grammar x sentence) float64 matrix for all of them")
+
+add_ordering_arguments(parser)
+
 args = parser.parse_args()
 
-for i in range(64):
-    grammar = format(i, '06b')[::-1]
+_, grammars = selected_orderings(args)
+grammars = list(grammars)
+rows = []
+for grammar in grammars:
     score_files = [os.path.join(args.file_location, grammar, 
         f) for f in os.listdir(os.path.join(args.file_location, 
             grammar)) if f.endswith('.txt')]
@@ -24,9 +37,20 @@ for i in range(64):
         file = open(f, 'r')
         file_scores = file.readlines()
         scores += file_scores
+    if args.format == "npy":
+        rows.append(np.array(scores, dtype=np.float64))
+        continue
     if not os.path.exists(os.path.join(args.output_folder)):
         os.mkdir(os.path.join(args.output_folder))
     output_file = open(os.path.join(args.output_folder, 
         grammar + "_scores.txt"), 'w')
     for s in scores:
-        output_file.write(s)
\ No newline at end of file
+        output_file.write(s)
+
+if args.format == "npy":
+    lengths = {len(r) for r in rows}
+    if len(lengths) > 1:
+        sys.exit(f"Grammars have different numbers of sentences: "
+            f"{sorted(lengths)}")
+    write_score_matrix(args.output_folder, grammars,
+        np.stack(rows) if rows else np.empty((0, 0)))
@@ -1,52 +1,153 @@
 import csv
 import argparse
+import json
 import os
 import math
+import sys
+
+from orderings import add_ordering_arguments, selected_orderings
+from results_db import connect, grammar_perplexities
+
+def final_line(filename, block_size=4096):
+	"""Last line of a file, read backwards from its end"""
+	with open(filename, 'rb') as file:
+		end = file.seek(0, os.SEEK_END)
+		tail = b""
+		position = end
+		while position > 0:
+			step = min(block_size, position)
+			position -= step
+			file.seek(position)
+			tail = file.read(step) + tail
+			# a newline before the last line's own ending bounds that line
+			if b"\n" in tail[:-1]:
+				break
+	lines = tail.decode(errors="replace").split("\n")
+	return lines[-2] if tail.endswith(b"\n") else lines[-1]
 
 def get_perplexity(filename):
-	file = open(filename, 'r')
-	lines = file.readlines()
-	final_line = lines[-1].strip('\n')
-	return float(final_line.split(" ")[-1])
-
-def calc_sd(vals):
-	mean = calc_mean(vals)
-	return math.sqrt(sum([(x - mean)**2 for x in vals])/len(vals))
-
-def calc_mean(vals):
-	return sum(vals)/len(vals)
-
-parser = argparse.ArgumentParser(description="Calculate mean and SD of "
-	"perplexity for dev and test for each grammar")
-
-parser.add_argument("-f", "--folder", type=str, required=True,
-    help="Location of results file")
-
-parser.add_argument("-o", "--output", type=str, required=True, 
-	help="Location to save output")
-
-args = parser.parse_args()
-
-results_files = [os.path.join(args.folder, f) for f in os.listdir(
-	args.folder) if f.endswith('.txt')]
-perplexity_dict = {}
-for res in results_files:
-	grammar, split, test_dev, _ = res.split("/")[-1].split(".")
-	if grammar not in perplexity_dict.keys():
-		perplexity_dict[grammar] = {}
-	if test_dev not in perplexity_dict[grammar].keys():
-		perplexity_dict[grammar][test_dev] = []
-	perplexity_dict[grammar][test_dev].append(get_perplexity(res))
-
-output_file = open(args.output, 'w')
-fieldnames = ['grammar', 'dev_av', 'dev_sd', 'tst_av', 'tst_sd']
-writer = csv.DictWriter(output_file, fieldnames=fieldnames)
-writer.writeheader()
-for i in range(64):
-	grammar = format(i, '06b')
-	writer.writerow({'grammar':grammar, 
-		'dev_av':calc_mean(perplexity_dict[grammar]['dev']),
-		'dev_sd':calc_sd(perplexity_dict[grammar]['dev']),
-		'tst_av':calc_mean(perplexity_dict[grammar]['test']),
-		'tst_sd':calc_sd(perplexity_dict[grammar]['test'])
-		})
+	return float(final_line(filename).split(" ")[-1])
+
+class RunningStats:
+	"""Mean and standard deviation of values added one at a time"""
+	def __init__(self):
+		self.count = 0
+		self.mean = 0.0
+		self.m2 = 0.0
+
+	def add(self, x):
+		self.count += 1
+		delta = x - self.mean
+		self.mean += delta/self.count
+		self.m2 += delta*(x - self.mean)
+
+	def sd(self):
+		return math.sqrt(self.m2/self.count)
+
+def load_manifest(filename):
+	if not os.path.exists(filename):
+		return {}
+	with open(filename, 'r') as file:
+		return json.load(file)
+
+def save_manifest(filename, manifest):
+	with open(filename + ".part", 'w') as file:
+		json.dump(manifest, file, sort_keys=True)
+	os.replace(filename + ".part", filename)
+
+def read_perplexities(results_files, manifest):
+	"""
+	Perplexity of each results file, read only for files whose mtime and
+	size differ from their manifest entry. Files without a perplexity on
+	their last line, such as those of jobs still running, are left out
+	"""
+	perplexities = {}
+	for res in results_files:
+		stat = os.stat(res)
+		entry = manifest.get(res)
+		if entry is not None and entry[:2] == [stat.st_mtime_ns, stat.st_size]:
+			perplexities[res] = entry[2]
+			continue
+		try:
+			perplexities[res] = get_perplexity(res)
+		except (ValueError, IndexError):
+			print("No perplexity yet in", res, file=sys.stderr)
+			manifest.pop(res, None)
+			continue
+		manifest[res] = [stat.st_mtime_ns, stat.st_size, perplexities[res]]
+	for res in set(manifest) - set(results_files):
+		del manifest[res]
+	return perplexities
+
+def folder_perplexities(folder, manifest_file):
+	"""{grammar: {dev|test: (mean, sd)}} of the results files in folder"""
+	manifest = load_manifest(manifest_file)
+	results_files = [os.path.join(folder, f) for f in os.listdir(
+		folder) if f.endswith('.txt')]
+	perplexities = read_perplexities(results_files, manifest)
+	save_manifest(manifest_file, manifest)
+
+	perplexity_dict = {}
+	for res, perplexity in sorted(perplexities.items()):
+		grammar, split, test_dev, _ = res.split("/")[-1].split(".")
+		if grammar not in perplexity_dict.keys():
+			perplexity_dict[grammar] = {}
+		if test_dev not in perplexity_dict[grammar].keys():
+			perplexity_dict[grammar][test_dev] = RunningStats()
+		perplexity_dict[grammar][test_dev].add(perplexity)
+	return {grammar: {test_dev: (stats.mean, stats.sd()) for test_dev, stats
+		in subsets.items()} for grammar, subsets in perplexity_dict.items()}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Calculate mean and SD of "
+		"perplexity for dev and test for each grammar")
+
+	parser.add_argument("-f", "--folder", type=str, default='',
+	    help="Location of results file")
+
+	parser.add_argument("-o", "--output", type=str, required=True,
+		help="Location to save output")
+
+	parser.add_argument("-m", "--manifest", type=str, default='',
+		help="Perplexities already read, by file mtime and size, default the "
+		"output with .manifest.json appended")
+
+	parser.add_argument("-d", "--database", type=str, default='',
+		help="Read perplexities from this results database instead of a folder")
+
+	parser.add_argument("--model", type=str, default='transformer',
+		help="Model whose results are read from the database")
+
+	parser.add_argument("--setting", type=str, default='',
+		help="Setting whose results are read from the database")
+
+	add_ordering_arguments(parser)
+
+	args = parser.parse_args()
+
+	if len(args.database) > 0:
+		perplexity_dict = grammar_perplexities(connect(args.database),
+			args.model, args.setting)
+	elif len(args.folder) > 0:
+		perplexity_dict = folder_perplexities(args.folder,
+			args.manifest or args.output + ".manifest.json")
+	else:
+		sys.exit("Error: Provide either a results folder or a database")
+
+	output_file = open(args.output, 'w')
+	fieldnames = ['grammar', 'dev_av', 'dev_sd', 'tst_av', 'tst_sd']
+	writer = csv.DictWriter(output_file, fieldnames=fieldnames)
+	writer.writeheader()
+	_, grammars = selected_orderings(args)
+	missing = []
+	for grammar in grammars:
+		row = {'grammar':grammar}
+		for test_dev, prefix in [('dev', 'dev'), ('test', 'tst')]:
+			stats = perplexity_dict.get(grammar, {}).get(test_dev)
+			if stats is None:
+				missing.append(grammar + " " + test_dev)
+				continue
+			row[prefix + '_av'], row[prefix + '_sd'] = stats
+		writer.writerow(row)
+	if missing:
+		print("No results for:", ", ".join(missing), file=sys.stderr)
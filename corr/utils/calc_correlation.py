@@ -2,11 +2,16 @@
 import argparse
 import json
 import os
+import sys
 from typing import Tuple, Dict, Any
 
 import pandas as pd
 from scipy import stats
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, os.pardir))
+import results_db
+
 
 def calc_correlation(ppl_df: pd.DataFrame, freq_df: pd.DataFrame) -> Dict[str, Any]:
     """Calculate correlation between features and perplexity, report a significance."""
@@ -34,9 +39,20 @@ def calc_correlation(ppl_df: pd.DataFrame, freq_df: pd.DataFrame) -> Dict[str, A
     }
 
 
-def read_data(ppl_file: str, freq_file: str, section: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
-    ppl_df = pd.read_csv(ppl_file)
-    ppl_df = ppl_df[ppl_df['setting'] == section]
+def read_ppl_database(database: str, model: str, section: str) -> pd.DataFrame:
+    """Test perplexities of one model and setting in the layout of perplexity_scores.csv."""
+    rows = results_db.run_perplexities(results_db.connect(database), model, section, 'test')
+    return pd.DataFrame([(setting, split, grammar, perplexity) for setting, grammar, split, _, perplexity in rows],
+                        columns=['setting', 'div', 'grammar', 'perplexity'])
+
+
+def read_data(ppl_file: str, freq_file: str, section: str, model: str = '') -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Read perplexities from ppl_file, a CSV or, when model is given, a results database."""
+    if model:
+        ppl_df = read_ppl_database(ppl_file, model, section)
+    else:
+        ppl_df = pd.read_csv(ppl_file)
+        ppl_df = ppl_df[ppl_df['setting'] == section]
     freq_df = pd.read_csv(freq_file)
 
     # normalize grammar column
@@ -57,13 +73,14 @@ def read_data(ppl_file: str, freq_file: str, section: str) -> Tuple[pd.DataFrame
 if __name__ == '__main__':
     """Main function to process command line arguments and run correlation analysis."""
     parser = argparse.ArgumentParser('Calculate correlation between features and perplexity, report a significance.')
-    parser.add_argument('--ppl_file', type=str, required=True, help='input file with perplexity scores')
+    parser.add_argument('--ppl_file', type=str, required=True, help='input file with perplexity scores, or a results database with --model')
+    parser.add_argument('--model', type=str, default='', help='read perplexities of this model from --ppl_file as a results database')
     parser.add_argument('--freq_file', type=str, required=True, help='input file with frequency scores')
     parser.add_argument('--section', type=str, required=True, help='section to analyze (e.g., "1-1", "2-1", etc.)')
     args = parser.parse_args()
 
     # read data
-    ppl_df, freq_df = read_data(args.ppl_file, args.freq_file, args.section)
+    ppl_df, freq_df = read_data(args.ppl_file, args.freq_file, args.section, args.model)
 
     # calc correlation
     results = calc_correlation(ppl_df, freq_df)
@@ -1,9 +1,14 @@
 """Extract features from wals dataset and dump to a file."""
 import argparse
 import os
+import sys
 
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, os.pardir))
+from orderings import OrderingSpace
+
 
 def extract_feature(parameter, attribute, input_dir = 'corr/wals'):
     """Extract features from the wals dataset.
@@ -149,10 +154,11 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser('Extract features from wals dataset.')
     parser.add_argument('--input_dir', '-i', type=str, help='input directory', default='corr/wals')
     parser.add_argument('--output_dir', '-o', type=str, help='output directory', default='corr/frequency.csv')
+    parser.add_argument('--orderings', type=str, help='orderings to score, as selected in orderings.py', default='all')
     args = parser.parse_args()
 
-    # get language names
-    language_names = [f'{i:06b}' for i in range(0, 64)]
+    # get language names, one digit per wals feature
+    language_names = list(OrderingSpace(6).select(args.orderings))
 
     # calculate frequency for each language
     frequencies = []
@@ -0,0 +1,110 @@
+"""Content-addressed cache of the outputs of data_gen stages.
+
+A stage run is keyed by a hash of the stage name, its parameters, the
+source of the code that produces it and the content of its input files.
+The first run with a key writes into a fresh folder in the cache, which is
+then linked file by file into the requested output folder. A later run with
+the same key only makes the links.
+
+Linked outputs share their files with the cache, so the stages replace
+their outputs (see compressed.open_replacing) rather than rewriting them in
+place, whether or not they run through the cache.
+"""
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+
+def update_with_file(digest, path):
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            digest.update(block)
+
+
+def files_under(path):
+    """Files at or below path, sorted, relative to path"""
+    if os.path.isfile(path):
+        return [""]
+    found = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for f in sorted(files):
+            found.append(os.path.relpath(os.path.join(root, f), path))
+    return found
+
+
+def stage_key(stage, code_files, inputs, params):
+    """
+    Hex digest of a stage run. inputs are files or folders, whose files are
+    hashed with their relative names
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([stage, params], sort_keys=True).encode())
+    for path in list(code_files) + list(inputs):
+        for name in files_under(path):
+            digest.update(name.encode() + b"\0")
+            update_with_file(digest, os.path.join(path, name) if name 
+                else path)
+    return digest.hexdigest()
+
+
+def link_tree(source, destination):
+    """
+    Link every file under source to the same place under destination,
+    replacing files already there and copying across file systems. A file
+    already linked is left as it is. Any other is stamped with the current
+    time, so that outputs built from it before (as found by the -nt checks
+    of the training scripts) are seen to be older
+    """
+    for name in files_under(source):
+        origin = os.path.join(source, name)
+        target = os.path.join(destination, name)
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        if os.path.isfile(target) and os.path.samefile(origin, target):
+            continue
+        partial = target + ".link"
+        try:
+            os.link(origin, partial)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.copyfile(origin, partial)
+        os.utime(partial)
+        os.replace(partial, target)
+
+
+def run_cached(cache_dir, stage, code_files, inputs, params, output_folder,
+        run):
+    """
+    Fill output_folder with the outputs of run(folder), a function writing a
+    stage's outputs into an empty folder, calling it only on a cache miss.
+    Returns whether the run was a cache hit
+    """
+    key = stage_key(stage, code_files, inputs, params)
+    stage_dir = os.path.join(cache_dir, stage)
+    entry = os.path.join(stage_dir, key)
+    hit = os.path.isdir(entry)
+    if not hit:
+        os.makedirs(stage_dir, exist_ok=True)
+        partial = tempfile.mkdtemp(prefix=key + ".", dir=stage_dir)
+        try:
+            run(partial)
+        except BaseException:
+            shutil.rmtree(partial)
+            raise
+        try:
+            os.rename(partial, entry)
+        except OSError:
+            # another run filled the same entry first
+            if not os.path.isdir(entry):
+                raise
+            shutil.rmtree(partial)
+    link_tree(entry, output_folder)
+    print(f"{stage}: cache {'hit' if hit else 'miss'} {key[:12]}")
+    return hit
@@ -0,0 +1,180 @@
+"""Reading and writing corpus files that may be compressed.
+
+The compression of a file is chosen by its extension: .gz, .bz2 and .xz use
+the standard library, and .zst uses the zstandard package, which is only
+needed for those files. Any other file is read and written as is.
+
+Every permuted corpus uses the same words, so zstd files can share a
+dictionary trained on a sample of all of them. A zstd file is read and
+written with the DICTIONARY_NAME file found in its folder or the nearest
+folder above it, if there is one.
+"""
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
+import mmap
+import os
+import shutil
+
+# extension, as given to --compression, for each compressed format
+EXTENSIONS = (".gz", ".bz2", ".xz", ".zst")
+DICTIONARY_NAME = "zstd.dict"
+# prefix of the file written by open_replacing until it replaces its target
+PARTIAL_PREFIX = ".part-"
+
+
+def compression_of(path):
+    """Extension giving the compression of path, or '' if it has none"""
+    for extension in EXTENSIONS:
+        if path.endswith(extension):
+            return extension
+    return ''
+
+
+def strip_compression(path):
+    """path without its compression extension"""
+    return path[:len(path) - len(compression_of(path))]
+
+
+def is_corpus(filename, extension=".txt"):
+    """
+    Whether filename ends in extension, compressed or not, and is not the
+    partial output of an interrupted open_replacing
+    """
+    return (strip_compression(filename).endswith(extension)
+        and not os.path.basename(filename).startswith(PARTIAL_PREFIX))
+
+
+def find_corpus(path):
+    """path, or path with the compression extension of an existing file"""
+    for candidate in (path,) + tuple(path + e for e in EXTENSIONS):
+        if os.path.exists(candidate):
+            return candidate
+    return path
+
+
+def zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .zst files requires the "
+            "zstandard package") from None
+    return zstandard
+
+
+def find_dictionary(path):
+    """DICTIONARY_NAME in the folder of path or above, or None"""
+    folder = os.path.dirname(os.path.abspath(path))
+    while True:
+        candidate = os.path.join(folder, DICTIONARY_NAME)
+        if os.path.exists(candidate):
+            return candidate
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return None
+        folder = parent
+
+
+def zstd_dictionary(path):
+    dictionary = find_dictionary(path)
+    if dictionary is None:
+        return None
+    with open(dictionary, 'rb') as f:
+        return zstandard().ZstdCompressionDict(f.read())
+
+
+def open_stream(path, mode='r', buffering=1 << 20):
+    """
+    Open path like open(), compressing or decompressing while streaming if
+    its extension says it is compressed
+    """
+    compression = compression_of(path)
+    binary = 'b' in mode
+    raw_mode = mode.replace('t', '').replace('b', '') + 'b'
+    if compression == '':
+        return open(path, mode, buffering=buffering)
+    if compression == ".gz":
+        stream = gzip.open(path, raw_mode, compresslevel=6)
+    elif compression == ".bz2":
+        stream = bz2.open(path, raw_mode)
+    elif compression == ".xz":
+        stream = lzma.open(path, raw_mode)
+    else:
+        zstd = zstandard()
+        dictionary = zstd_dictionary(path)
+        if 'r' in raw_mode:
+            stream = zstd.ZstdDecompressor(dict_data=dictionary).stream_reader(
+                open(path, 'rb'), closefd=True)
+        else:
+            stream = zstd.ZstdCompressor(dict_data=dictionary).stream_writer(
+                open(path, raw_mode), closefd=True)
+    if 'r' in raw_mode:
+        stream = io.BufferedReader(stream, buffer_size=buffering)
+    else:
+        stream = io.BufferedWriter(stream, buffer_size=buffering)
+    return stream if binary else io.TextIOWrapper(stream)
+
+
+@contextlib.contextmanager
+def open_replacing(path, mode='w', keep=False):
+    """
+    open_stream on a temporary file next to path, which replaces path when
+    the with block ends. path is never rewritten in place, so other links to
+    it (such as outputs linked from an artifact cache) keep their content.
+    An error leaves path as it was, unless keep is set, in which case what
+    was written before the error replaces it
+    """
+    folder, name = os.path.split(path)
+    partial = os.path.join(folder, PARTIAL_PREFIX + name)
+    try:
+        with open_stream(partial, mode) as f:
+            yield f
+    except BaseException:
+        if not keep:
+            os.remove(partial)
+            raise
+        os.replace(partial, path)
+        raise
+    os.replace(partial, path)
+
+
+@contextlib.contextmanager
+def corpus_bytes(path):
+    """
+    The bytes of a file as a read-only buffer: a memory map of a plain file,
+    or the decompressed content of a compressed one
+    """
+    if compression_of(path) != '':
+        with open_stream(path, 'rb') as f:
+            yield f.read()
+        return
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def train_dictionary(samples, output_folder, size=1 << 17):
+    """
+    Train a zstd dictionary on samples (bytes, such as blocks of sentences
+    from every corpus) and save it as DICTIONARY_NAME in output_folder
+    """
+    dictionary = zstandard().train_dictionary(size, list(samples))
+    with open(os.path.join(output_folder, DICTIONARY_NAME), 'wb') as f:
+        f.write(dictionary.as_bytes())
+
+
+def share_dictionary(input_path, output_folder):
+    """
+    Copy the dictionary used for input_path into output_folder, so that zstd
+    files written there use it too
+    """
+    dictionary = find_dictionary(input_path)
+    target = os.path.join(output_folder, DICTIONARY_NAME)
+    if dictionary is not None and find_dictionary(target) is None:
+        os.makedirs(output_folder, exist_ok=True)
+        shutil.copyfile(dictionary, target)
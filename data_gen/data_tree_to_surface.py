@@ -1,33 +1,92 @@
 """Extract data to the surface form (the final step)."""
 import argparse
-import os
 import json
+import multiprocessing
+import os
+
+from compressed import DICTIONARY_NAME, open_stream, share_dictionary
+
+SURFACE_KEY = '"surface":'
+decoder = json.JSONDecoder()
+
+
+def surface_of(line: str):
+    """The surface field of one JSON line, decoding only that field when the
+    key appears once"""
+    start = line.find(SURFACE_KEY)
+    if start == -1 or line.find(SURFACE_KEY, start + 1) != -1:
+        return json.loads(line)['surface']
+    start += len(SURFACE_KEY)
+    while line[start] in ' \t':
+        start += 1
+    return decoder.raw_decode(line, start)[0]
 
 
 def extract_surface(filename: str):
-    with open(filename, 'r') as f:
-        data = [json.loads(line)['surface'] for line in f.readlines()]
+    with open_stream(filename, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield surface_of(line)
+
+
+def up_to_date(input_file: str, output_file: str):
+    """Whether output_file was written after input_file last changed"""
+    return (os.path.exists(output_file)
+        and os.path.getmtime(output_file) >= os.path.getmtime(input_file))
+
+
+def write_surface(paths):
+    """Convert one file, through a temporary file so that an interrupted run
+    leaves no partial output, compressing it as the input was"""
+    input_file, output_file = paths
+    folder, name = os.path.split(output_file)
+    partial = os.path.join(folder, '.part-' + name)
+    # TODO: examine why a period is missing from the end of the line, during the data generation
+    with open_stream(partial, 'w') as f:
+        f.writelines(line + ' . ' + '\n' for line in extract_surface(input_file))
+    os.replace(partial, output_file)
+    return output_file
 
-    return data
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Extract the surface form from the data.")
     parser.add_argument('-i', '--input_file', type=str, required=True)
     parser.add_argument('-o', '--output_file', type=str, required=True)
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of files converted at once')
+    parser.add_argument('-f', '--force', action='store_true', help='rewrite outputs that are newer than their inputs')
     args = parser.parse_args()
+    # a converted file is no longer JSON, so it could not be converted again
+    if os.path.abspath(args.input_file) == os.path.abspath(args.output_file):
+        parser.error('the output folder must differ from the input folder')
 
     formations = ['prefix', 'suffix', 'infix']
+    jobs = []
     for formation in formations:
         input_path = os.path.join(args.input_file, formation, 'permuted_splits')
 
+        # zstd files are written with the dictionary they were read with
+        share_dictionary(os.path.join(input_path, DICTIONARY_NAME), os.path.join(args.output_file, formation, 'permuted_splits'))
+
         for languagename in os.listdir(input_path):
-            for filename in os.listdir(os.path.join(input_path, languagename)):
-                output_path = os.path.join(args.output_file, formation, 'permuted_splits', languagename)
-                os.makedirs(output_path, exist_ok=True)
+            if not os.path.isdir(os.path.join(input_path, languagename)):
+                continue
+            output_path = os.path.join(args.output_file, formation, 'permuted_splits', languagename)
+            os.makedirs(output_path, exist_ok=True)
 
-                data = extract_surface(os.path.join(input_path, languagename, filename))
+            for filename in os.listdir(os.path.join(input_path, languagename)):
+                # skip the partial outputs of an interrupted run
+                if filename.startswith('.part-'):
+                    continue
+                input_file = os.path.join(input_path, languagename, filename)
+                output_file = os.path.join(output_path, filename)
+                if args.force or not up_to_date(input_file, output_file):
+                    jobs.append((input_file, output_file))
 
-                # TODO: examine why a period is missing from the end of the line, during the data generation
-                with open(os.path.join(output_path, filename), 'w') as f:
-                    for line in data:
-                        f.write(line + ' . ' + '\n')
+    if args.workers > 1:
+        with multiprocessing.Pool(args.workers) as pool:
+            for _ in pool.imap_unordered(write_surface, jobs):
+                pass
+    else:
+        for job in jobs:
+            write_surface(job)
+    print(f"Wrote {len(jobs)} files")
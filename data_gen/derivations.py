@@ -0,0 +1,241 @@
+"""Compact binary storage for sampled derivations.
+
+A derivation is stored as the rule ids applied at its nonterminal nodes in
+preorder, with UNEXPANDED for a nonterminal that was written as "...". Each
+node also stores the position just past its subtree, so the children of a
+node can be found without walking the tree. The grammar's rules are saved
+in the same file so that readers do not need the grammar file.
+"""
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+# rule id of a nonterminal left unexpanded when a derivation was truncated
+UNEXPANDED = -1
+
+# markers used by DerivationFile.bracketed
+NODE = object()
+CLOSE = object()
+
+
+def subtree_ends(rules, rule_arity):
+    """Position just past each node's subtree for one preorder rule list"""
+    ends = [0] * len(rules)
+    # nodes whose subtree is still open, with how many children they lack
+    open_nodes = []
+    for i, rule in enumerate(rules):
+        open_nodes.append([i, rule_arity[rule] if rule != UNEXPANDED else 0])
+        while open_nodes and open_nodes[-1][1] == 0:
+            node, _ = open_nodes.pop()
+            ends[node] = i + 1
+            if open_nodes:
+                open_nodes[-1][1] -= 1
+    return ends
+
+
+def write_derivations(output_path, grammar, derivations):
+    """
+    Save derivations (sequences of rule ids of grammar, a PCFG) to
+    output_path as an uncompressed .npz file
+    """
+    with DerivationWriter(output_path, grammar) as writer:
+        writer.write(derivations)
+
+
+class DerivationWriter:
+    """
+    Save derivations to an .npz file a batch at a time. Each batch is
+    appended to raw files next to output_path, which close copies into the
+    .npz in blocks, so only one batch is held in memory. Leaving a with
+    block on an error still saves the batches written in full
+    """
+    def __init__(self, output_path, grammar):
+        self.output_path = output_path
+        self.grammar = grammar
+        self.rule_arity = [sum(grammar.is_nonterminal[t] for t in rhs)
+            for rhs in grammar.rule_rhs]
+        self.rules_dtype = smallest_int(len(grammar.rule_rhs))
+        # raw array of each column, with the type it is appended in
+        self.parts = {'rules': (output_path + ".rules.part", self.rules_dtype),
+            'ends': (output_path + ".ends.part", np.int32),
+            'offsets': (output_path + ".offsets.part", np.int64)}
+        self.files = {name: open(path, 'wb')
+            for name, (path, _) in self.parts.items()}
+        self.files['offsets'].write(np.zeros(1, dtype=np.int64).tobytes())
+        # rule ids and derivations in the batches written in full
+        self.total = 0
+        self.count = 0
+        self.longest = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, derivations):
+        rules = []
+        ends = []
+        offsets = [0]
+        for derivation in derivations:
+            rules += derivation
+            ends += subtree_ends(derivation, self.rule_arity)
+            offsets.append(len(rules))
+        self.write_arrays(np.array(rules, dtype=np.int64), 
+            np.array(ends, dtype=np.int64), np.array(offsets, dtype=np.int64))
+
+    def write_arrays(self, rules, ends, offsets):
+        """
+        Append derivations given as flat arrays, derivation i being
+        rules[offsets[i]:offsets[i + 1]] with ends relative to its start
+        """
+        for name, values in (('rules', rules), ('ends', ends),
+                ('offsets', self.total + offsets[1:])):
+            self.files[name].write(
+                values.astype(self.parts[name][1]).tobytes())
+        # a batch interrupted before this point is left out by close
+        self.total += int(offsets[-1])
+        self.count += len(offsets) - 1
+        self.longest = max(self.longest, int(np.diff(offsets).max(initial=0)))
+
+    def close(self, block_size=1 << 20):
+        for f in self.files.values():
+            f.close()
+        # one "lhs<TAB>rhs<TAB>choice point" line per rule
+        grammar = self.grammar
+        rule_text = ''.join(f"{grammar.symbols[lhs]}\t{' '.join(tokens)}\t{change}\n"
+            for lhs, tokens, change in zip(grammar.rule_lhs,
+                grammar.rule_tokens, grammar.rule_change))
+        columns = {'rules': (self.rules_dtype, self.total),
+            'ends': (smallest_int(self.longest), self.total),
+            'offsets': (np.int64, self.count + 1)}
+        partial = self.output_path + ".part"
+        # laid out as np.savez does, with the columns converted a block at a
+        # time rather than loaded whole
+        with zipfile.ZipFile(partial, 'w', allowZip64=True) as archive:
+            for name, (dtype, n) in columns.items():
+                path, part_dtype = self.parts[name]
+                with archive.open(name + ".npy", 'w', force_zip64=True) as f:
+                    np.lib.format.write_array_header_1_0(f, {
+                        'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                        'fortran_order': False, 'shape': (n,)})
+                    if n:
+                        values = np.memmap(path, dtype=part_dtype, mode='r',
+                            shape=(n,))
+                        for start in range(0, n, block_size):
+                            f.write(values[start:start + block_size]
+                                .astype(dtype).tobytes())
+                        del values
+            with archive.open("grammar.npy", 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f,
+                    np.frombuffer(rule_text.encode(), dtype=np.uint8))
+        os.replace(partial, self.output_path)
+        self.discard()
+
+    def discard(self):
+        """Remove the raw files"""
+        for f in self.files.values():
+            f.close()
+        for path, _ in self.parts.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def stored_arrays(path):
+    """
+    Arrays of an .npz file by name. Members stored uncompressed, as
+    DerivationWriter writes them, are memory-mapped, so processes reading
+    the same file share its pages rather than each loading a copy
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            # the member's data follows its local header, whose name and
+            # extra field lengths may differ from the central directory's
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                else np.lib.format.read_array_header_2_0)
+            shape, _, dtype = read_header(f)
+            if 0 in shape:
+                # np.memmap cannot map an empty range
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r',
+                    offset=f.tell(), shape=shape)
+    return arrays
+
+
+def smallest_int(largest):
+    """Signed integer type able to hold values up to largest"""
+    return np.int16 if largest < 2**15 else np.int32
+
+
+class DerivationFile:
+    """
+    Derivations written by write_derivations. Node positions in ends are
+    relative to the start of their derivation. The arrays are
+    memory-mapped, so derivations are only read as they are used
+    """
+    def __init__(self, path):
+        data = stored_arrays(path)
+        self.rules = data['rules']
+        self.ends = data['ends']
+        self.offsets = data['offsets']
+        lines = data['grammar'].tobytes().decode().splitlines()
+        lhs, rhs, change = zip(*(l.split("\t") for l in lines))
+        self.rule_lhs = list(lhs)
+        self.rule_change = [int(c) for c in change]
+        nonterminals = set(self.rule_lhs)
+        # rhs of each rule as words (str) and nonterminal children (None)
+        self.rule_rhs = [[None if t in nonterminals else t for t in r.split(" ")]
+            for r in rhs]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        """Rule ids and subtree ends of derivation i, as lists"""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.rules[start:end].tolist(), self.ends[start:end].tolist()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def bracketed(self, rules):
+        """Tokens of a derivation as sample_sentences.py -b writes them"""
+        tokens = []
+        node = 0
+        # rhs items still to write, in reverse: words, NODE for the next node 
+        # in preorder and CLOSE for the end of a constituent
+        stack = [NODE]
+        while stack:
+            item = stack.pop()
+            if item is CLOSE:
+                tokens.append(")")
+            elif item is not NODE:
+                tokens.append(item)
+            elif rules[node] == UNEXPANDED:
+                tokens.append("...")
+                node += 1
+            else:
+                rule = rules[node]
+                change = self.rule_change[rule]
+                tokens.append("(")
+                tokens.append((str(change) if change != -1 else "") 
+                    + self.rule_lhs[rule])
+                stack.append(CLOSE)
+                stack.extend(NODE if t is None else t 
+                    for t in reversed(self.rule_rhs[rule]))
+                node += 1
+        return tokens
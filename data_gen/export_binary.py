@@ -0,0 +1,238 @@
+"""Write fairseq language_modeling datasets for every grammar and split.
+
+This does the job of running fairseq-preprocess --only-source once per
+(grammar, split), reading the sample files and a split manifest from
+make_splits.py directly. Each output folder holds dict.txt and the
+train/valid/test .bin and .idx files of fairseq's mmap dataset format.
+
+Every sample file is a permutation of the same sentences, so a split's
+training sentences have the same word counts in every grammar. Its
+dictionary, built the way fairseq-preprocess builds one from the training
+file, is computed once and shared by all grammars.
+"""
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import struct
+import sys
+
+import numpy as np
+
+from artifact_cache import run_cached
+from compressed import find_corpus, is_corpus, open_replacing, open_stream
+from make_splits import grammar_of, sentence_order
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+from orderings import add_ordering_arguments, selected_orderings
+
+# fairseq's special symbols, which take the first dictionary ids
+SPECIALS = ["<s>", "<pad>", "</s>", "<unk>"]
+EOS = SPECIALS.index("</s>")
+UNK = SPECIALS.index("<unk>")
+# fairseq pads the dictionary to a multiple of this many symbols
+PADDING_FACTOR = 8
+
+# names fairseq gives the subsets written from each split extension
+SUBSETS = {".trn": "train", ".dev": "valid", ".tst": "test"}
+
+# MMapIndexedDataset index header and its codes for token types
+INDEX_MAGIC = b"MMIDIDX\x00\x00"
+DTYPE_CODES = {np.uint16: 8, np.uint32: 9}
+
+# vocab id standing for the end of a line; other ids are words as bytes
+EOS_WORD = 0
+
+
+class TokenizedSample:
+    """
+    Words of a sample file as ids into vocab, a dict shared by every sample
+    file that new words are added to, with EOS_WORD closing each line
+    """
+    def __init__(self, sample_file, vocab):
+        ids = []
+        lengths = []
+        # lines are read as they are decompressed, not buffered whole
+        with open_stream(sample_file, 'rb') as lines:
+            for line in lines:
+                words = line.split()
+                for w in words:
+                    if w not in vocab:
+                        vocab[w] = len(vocab)
+                ids += [vocab[w] for w in words]
+                ids.append(EOS_WORD)
+                lengths.append(len(words) + 1)
+        self.ids = np.array(ids, dtype=np.int64)
+        self.lengths = np.array(lengths, dtype=np.int64)
+        self.starts = np.concatenate(([0], np.cumsum(self.lengths)[:-1]))
+
+    def positions(self, lines):
+        """Positions in self.ids of the tokens of lines, in that order"""
+        lengths = self.lengths[lines]
+        # offset of each token from the start of its own line
+        within = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths)
+        return np.repeat(self.starts[lines], lengths) + within
+
+
+def split_dictionary(sample, lines, vocab):
+    """
+    (symbols, counts, remap) of the dictionary fairseq-preprocess would
+    build from these lines; remap takes vocab ids to dictionary ids
+    """
+    counts = np.bincount(sample.ids[sample.positions(lines)],
+        minlength=len(vocab))
+    words = [(w.decode(), counts[i]) for w, i in vocab.items()
+        if w is not None and counts[i] > 0]
+    # fairseq orders by count, breaking ties alphabetically
+    words.sort(key=lambda wc: wc[0])
+    words.sort(key=lambda wc: wc[1], reverse=True)
+    symbols = SPECIALS + [w for w, _ in words]
+    dict_counts = [0] * len(SPECIALS) + [int(c) for _, c in words]
+    i = 0
+    while len(symbols) % PADDING_FACTOR:
+        symbols.append(f"madeupword{i:04d}")
+        dict_counts.append(0)
+        i += 1
+    index = {w: i for i, w in enumerate(symbols)}
+    remap = np.full(len(vocab), UNK, dtype=np.int64)
+    for w, i in vocab.items():
+        remap[i] = EOS if w is None else index.get(w.decode(), UNK)
+    return symbols, dict_counts, remap
+
+
+def write_dictionary(path, symbols, counts):
+    """Save a dictionary as fairseq's dict.txt, without the special symbols"""
+    with open_replacing(path, 'w') as f:
+        for symbol, count in zip(symbols[len(SPECIALS):],
+                counts[len(SPECIALS):]):
+            f.write(f"{symbol} {count}\n")
+
+
+def write_dataset(prefix, tokens, sizes, vocab_size):
+    """
+    Save token ids with one entry of sizes per sentence as prefix.bin and
+    prefix.idx, as MMapIndexedDatasetBuilder does
+    """
+    dtype = np.uint16 if vocab_size < 65500 else np.uint32
+    with open_replacing(prefix + ".bin", 'wb') as data:
+        tokens.astype(dtype).tofile(data)
+    sizes = sizes.astype(np.int32)
+    pointers = np.zeros(len(sizes), dtype=np.int64)
+    np.cumsum(sizes[:-1] * np.dtype(dtype).itemsize, out=pointers[1:])
+    with open_replacing(prefix + ".idx", 'wb') as index:
+        index.write(INDEX_MAGIC)
+        index.write(struct.pack("<Q", 1))
+        index.write(struct.pack("<B", DTYPE_CODES[dtype]))
+        index.write(struct.pack("<Q", len(sizes)))
+        index.write(sizes.tobytes(order='C'))
+        index.write(pointers.tobytes(order='C'))
+
+
+def split_lines(manifest, splits=None):
+    """{split: {extension: sentence ids}} for the manifest's output files"""
+    order = sentence_order(manifest)
+    lines = {}
+    for i, extension, start, end in manifest["files"]:
+        if splits is not None and i not in splits:
+            continue
+        ids = np.arange(start, end) if order is None else order[start:end]
+        lines.setdefault(i, {})[extension] = ids
+    return lines
+
+
+def export_grammar(sample_file, manifest, vocab, dictionaries, lines, 
+        output_folder):
+    """Write every selected split of one sample file"""
+    vocab_size = len(vocab)
+    sample = TokenizedSample(sample_file, vocab)
+    if len(vocab) != vocab_size:
+        raise ValueError(f"{sample_file} has words that are not in the "
+            "other sample files")
+    if len(sample.lengths) != manifest["num_sentences"]:
+        raise ValueError(f"{sample_file} has {len(sample.lengths)} "
+            f"sentences, the manifest {manifest['num_sentences']}")
+    grammar = grammar_of(sample_file)
+    for i, subsets in lines.items():
+        symbols, counts, remap = dictionaries[i]
+        dest = os.path.join(output_folder, grammar, str(i) + "-dataset")
+        os.makedirs(dest, exist_ok=True)
+        write_dictionary(os.path.join(dest, "dict.txt"), symbols, counts)
+        for extension, ids in subsets.items():
+            tokens = remap[sample.ids[sample.positions(ids)]]
+            write_dataset(os.path.join(dest, SUBSETS[extension]), tokens,
+                sample.lengths[ids], len(symbols))
+
+
+def export_all(sample_files, manifest, output_folder, splits=None, workers=1):
+    """Export the splits numbered in splits, or all, of every sample file"""
+    lines = split_lines(manifest, splits)
+
+    # the vocabulary and dictionaries come from the first file and hold for
+    # all of them
+    vocab = {None: EOS_WORD}
+    first = TokenizedSample(sample_files[0], vocab)
+    dictionaries = {i: split_dictionary(first, subsets[".trn"], vocab)
+        for i, subsets in lines.items()}
+    del first
+
+    export_file = functools.partial(export_grammar, manifest=manifest,
+        vocab=vocab, dictionaries=dictionaries, lines=lines,
+        output_folder=output_folder)
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            for _ in pool.imap_unordered(export_file, sample_files):
+                pass
+    else:
+        for s in sample_files:
+            export_file(s)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write fairseq binary "
+        "datasets for all grammars and splits without fairseq-preprocess")
+
+    parser.add_argument("-S", "--sample_folder", type=str, required=True,
+        help="Path to folder containing the sample files")
+    parser.add_argument("-M", "--manifest", type=str, required=True,
+        help="Split manifest written by make_splits.py --write_manifest")
+    parser.add_argument("-O", "--output_folder", type=str, required=True,
+        help="Location of output folders, one per grammar and split")
+    parser.add_argument("--splits", type=str, default='',
+        help="Comma-separated split numbers to write, default all")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+        help="Number of sample files exported at once")
+    parser.add_argument("--cache_dir", type=str, default='',
+        help="Reuse datasets cached here for the same sample files and "
+        "manifest")
+    add_ordering_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.orderings != "all":
+        _, grammars = selected_orderings(args)
+        sample_files = [find_corpus(os.path.join(args.sample_folder,
+            "sample_" + g + ".txt")) for g in grammars]
+    else:
+        sample_files = [os.path.join(args.sample_folder, f) for f in
+            sorted(os.listdir(args.sample_folder)) if is_corpus(f)]
+
+    with open(args.manifest, 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    splits = None
+    if args.splits != '':
+        splits = sorted(int(i) for i in args.splits.split(","))
+
+    run = lambda output_folder: export_all(sample_files, manifest, 
+        output_folder, splits, args.workers)
+    if args.cache_dir == '':
+        run(args.output_folder)
+    else:
+        here = os.path.dirname(os.path.abspath(__file__))
+        run_cached(args.cache_dir, "export_binary", [os.path.join(here, f) 
+            for f in ("export_binary.py", "make_splits.py", "compressed.py")], 
+            sample_files, {"manifest": manifest, "splits": splits, 
+                "grammars": [grammar_of(s) for s in sample_files]}, 
+            args.output_folder, run)
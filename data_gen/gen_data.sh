@@ -1,10 +1,15 @@
-python sample_sentences.py -g base-grammar.gr -n 100000 -O . -b True
-python permute_sentences.py -s sample_base-grammar.txt -O permuted_samples/ 
-mkdir -p permuted_splits/base
-mkdir -p permuted_splits/1-1
-mkdir -p permuted_splits/1-2
-mkdir -p permuted_splits/1-3
-python make_splits.py -S permuted_samples -O permuted_splits/base -n 5
-python make_splits.py -S permuted_samples -O permuted_splits/1-1 -n 10
-python make_splits.py -S permuted_samples -O permuted_splits/1-2 -n 2
-python make_splits.py -S permuted_samples -O permuted_splits/1-3 -n 1
+# outputs are cached by their inputs and parameters, so a rerun with the same
+# SEED links the previous results instead of regenerating them
+CACHE=${CACHE:-.data_gen_cache}
+SEED=${SEED:-0}
+python sample_sentences.py -g base-grammar.gr -n 100000 -O . -b True --seed $SEED --cache_dir $CACHE
+python permute_sentences.py -s sample_base-grammar.txt -O permuted_samples/ --cache_dir $CACHE
+# the splits of each setting are saved as a manifest. export_binary.py writes
+# the fairseq datasets of every grammar and split from it, so the split files
+# themselves are only written by a training script that has to rebuild its
+# dataset, for its own grammar and split
+mkdir -p permuted_splits
+for SETTING in base:5 1-1:10 1-2:2 1-3:1; do
+    python make_splits.py -S permuted_samples -n ${SETTING#*:} --write_manifest permuted_splits/${SETTING%:*}.json
+    python export_binary.py -S permuted_samples -M permuted_splits/${SETTING%:*}.json -O ../data-bin/${SETTING%:*} --cache_dir $CACHE
+done
@@ -0,0 +1,143 @@
+"""Analytic statistics of a PCFG, computed from its rule probabilities.
+
+For each nonterminal A let E[A] be the expected number of rules applied in
+a derivation from A (its size, counted as PCFG.sample_derivation counts
+expansions) and L[A] the expected number of words it yields. With M[A, B]
+the expected number of B children of one expansion of A, both solve a
+linear system: E = 1 + M E and L = t + M L, where t[A] is the expected
+number of words written directly by an expansion of A. They are finite
+exactly when the spectral radius of M is below 1.
+
+The sampler stops expanding once more than max_expansions rules have been
+applied, so a derivation is truncated when its size exceeds
+max_expansions + 1. The size distribution is computed up to that bound,
+one size at a time, as the coefficients of the grammar's generating
+function.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from sample_sentences import PCFG
+
+
+class GrammarStats:
+    """Rule probabilities of a PCFG arranged by nonterminal"""
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.nonterminals = [s for s, nt in enumerate(grammar.is_nonterminal)
+            if nt]
+        row = {s: i for i, s in enumerate(self.nonterminals)}
+        self.row = row
+        # probabilities in rule id order, as compile_rules assigns the ids
+        self.rule_prob = [prob for poss in grammar.rules.values()
+            for _, prob in poss]
+        self.rule_row = [row[lhs] for lhs in grammar.rule_lhs]
+        self.rule_children = [[row[t] for t in rhs if t in row]
+            for rhs in grammar.rule_rhs]
+
+        n = len(self.nonterminals)
+        self.children = np.zeros((n, n))
+        self.words = np.zeros(n)
+        for prob, a, rhs, children in zip(self.rule_prob, self.rule_row,
+                grammar.rule_rhs, self.rule_children):
+            for b in children:
+                self.children[a, b] += prob
+            self.words[a] += prob * (len(rhs) - len(children))
+
+    def spectral_radius(self):
+        """Largest absolute eigenvalue of the expected children matrix"""
+        return max(abs(np.linalg.eigvals(self.children)), default=0.0)
+
+    def expectations(self):
+        """
+        Expected derivation size and yield length of every nonterminal, in
+        the order of self.nonterminals; both are infinite if the grammar is
+        not subcritical
+        """
+        n = len(self.nonterminals)
+        if self.spectral_radius() >= 1:
+            return np.full(n, np.inf), np.full(n, np.inf)
+        system = np.eye(n) - self.children
+        return (np.linalg.solve(system, np.ones(n)),
+            np.linalg.solve(system, self.words))
+
+    def size_distribution(self, n):
+        """
+        Array P with P[A, s] the probability that a derivation from
+        nonterminal A applies exactly s rules, for s < n
+        """
+        P = np.zeros((len(self.nonterminals), n))
+        # rules without nonterminal children only add to size 1
+        lexical = np.zeros(len(self.nonterminals))
+        # rules with children, grouped by their number of children
+        groups = {}
+        for prob, a, children in zip(self.rule_prob, self.rule_row,
+                self.rule_children):
+            if children:
+                groups.setdefault(len(children), []).append((prob, a, children))
+            else:
+                lexical[a] += prob
+        if n > 1:
+            P[:, 1] = lexical
+        arrays = []
+        for k, rules in groups.items():
+            probs, rows, children = zip(*rules)
+            children = np.array(children).T
+            # partial[i, r, d]: probability that the first i + 2 children of
+            # rule r together apply d rules
+            partial = np.zeros((k - 1, len(rules), n))
+            arrays.append((np.array(probs), np.array(rows), children, partial))
+        for s in range(2, n):
+            # the children of a rule applied at size s together apply d rules
+            d = s - 1
+            for probs, rows, children, partial in arrays:
+                coef = P[children[0], d]
+                for i in range(len(partial)):
+                    prev = P[children[0]] if i == 0 else partial[i - 1]
+                    partial[i, :, d] = (prev[:, :d + 1]
+                        * P[children[i + 1], d::-1]).sum(axis=1)
+                    coef = partial[i, :, d]
+                np.add.at(P[:, s], rows, probs * coef)
+        return P
+
+    def truncation_probabilities(self, budgets, symbol="ROOT"):
+        """
+        Probability that a derivation from symbol is cut short by each
+        max_expansions in budgets, including the probability that it never
+        ends
+        """
+        P = self.size_distribution(max(budgets) + 2)
+        below = np.cumsum(P[self.row[self.grammar.symbol_ids[symbol]]])
+        return [max(1.0 - below[m + 1], 0.0) for m in budgets]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute expected "
+        "derivation size, yield length and truncation probability of a "
+        "grammar without sampling")
+
+    parser.add_argument("-g", "--grammar_file", type=str, required=True,
+        help="Path to grammar file")
+    parser.add_argument("-m", "--max_expansions", type=int, nargs="+",
+        default=[50, 400, 800], help="Expansion budgets to evaluate")
+    parser.add_argument("-a", "--all_nonterminals", action="store_true",
+        help="Report expectations for every nonterminal, not only ROOT")
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = GrammarStats(PCFG(args.grammar_file))
+    sizes, lengths = stats.expectations()
+    print(f"Spectral radius of expected children: "
+        f"{stats.spectral_radius():.4f}")
+    print(f"{'nonterminal':<24}{'E[size]':>12}{'E[length]':>12}")
+    for symbol, size, length in zip(stats.nonterminals, sizes, lengths):
+        name = stats.grammar.symbols[symbol]
+        if args.all_nonterminals or name == "ROOT":
+            print(f"{name:<24}{size:>12.2f}{length:>12.2f}")
+    for m, prob in zip(args.max_expansions,
+            stats.truncation_probabilities(args.max_expansions)):
+        print(f"P(truncated at -m {m}): {prob:.6g}")
+    print(f"Computed in {time.perf_counter() - start:.3f}s")
@@ -1,71 +1,256 @@
+import argparse
+import contextlib
+import functools
+import itertools
+import json
+import multiprocessing
 import os
 import random
-import argparse
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+from orderings import add_ordering_arguments, selected_orderings
+
+from artifact_cache import run_cached
+from compressed import (compression_of, corpus_bytes, find_corpus, is_corpus, 
+    open_replacing, open_stream, share_dictionary, strip_compression)
 
-def create_splits(sample_file, num_splits, train, test, dev, output_folder):
-    if not os.path.exists(output_folder):
-        os.mkdir(output_folder)  
-    sentence_file = open(sample_file, 'r')
-    all_sentences = sentence_file.readlines()
-    num_all_sent = len(all_sentences)
-    grammar_name = sample_file[:-4].split("/")[-1]
-    grammar_name = grammar_name.split("_")[1]
-    if not os.path.exists(os.path.join(output_folder, grammar_name)):
-        os.mkdir(os.path.join(output_folder, grammar_name))
-    grammar_output = os.path.join(output_folder, grammar_name)
+def count_lines(path):
+    """Number of lines in a file, counting a final line without a newline"""
+    lines = 0
+    last = b"\n"
+    with open_stream(path, 'rb') as file:
+        while True:
+            block = file.read(1 << 20)
+            if not block:
+                break
+            lines += block.count(b"\n")
+            last = block[-1:]
+    return lines + (last != b"\n")
+
+def split_sizes(num_all_sent, num_splits, train, test):
+    """
+    (split, extension, number of sentences) for each output file in the
+    order their sentences appear in the sample file
+    """
     for i in range(num_splits):
         start = int(i * (1/num_splits) * num_all_sent)
         end = int((i+1) * (1/num_splits) * num_all_sent)
-        sentences = all_sentences[start:end]
-        num_sent = len(sentences)
-        trn_output = open(os.path.join(grammar_output, str(i) + ".trn"), 'w')
-        tst_output = open(os.path.join(grammar_output, str(i) + ".tst"), 'w')
-        dev_output = open(os.path.join(grammar_output, str(i) + ".dev"), 'w')
-        trn_split = sentences[:int(train*num_sent)]
-        tst_split = sentences[int(train*num_sent):int((train + test)*num_sent)]
-        dev_split = sentences[int((train + test)*num_sent):]
-        for s in trn_split:
-            trn_output.write(s)
-        for s in tst_split:
-            tst_output.write(s)
-        for s in dev_split:
-            dev_output.write(s)
-
-parser = argparse.ArgumentParser(
-    description="Divide generated sentences into splits")
-
-parser.add_argument("-s", "--sample_file", type=str, default='',
-    help="Path to sample file")
-parser.add_argument("-S", "--sample_folder", type=str, default='',
-    help="Path to folder containing multiple sample files")
-parser.add_argument("-O", "--output_folder", type=str, 
-    help="Location of output files")
-parser.add_argument("-tr", "--train", type=float, default=0.8, 
-    help="Train proportion")
-parser.add_argument("-ts", "--test", type=float, default=0.1, 
-    help="Test proportion")
-parser.add_argument("-dv", "--dev", type=float, default=0.1, 
-    help="Dev proportion")
-parser.add_argument("-n", "--num_splits", type=int, default=10, 
-    help="Number of splits")
-
-args = parser.parse_args()
-
-assert(args.train + args.test + args.dev == 1.0)
-
-if args.sample_file == '' and args.sample_folder == '':
-    print("Please provide sample files")
-elif args.sample_file != '' and args.sample_folder != '':
-    print("Please provide either a single file OR a folder containing sample"
-        " files")
-elif args.sample_file != '':
-    create_splits(args.sample_file, args.num_splits, args.train, args.test, 
-        args.dev, args.output_folder)
-elif args.sample_folder != '':
-    sample_files = [f for f in os.listdir(
-        args.sample_folder) if f.endswith('.txt')]
-    for s in sample_files:
-        create_splits(os.path.join(args.sample_folder, s), args.num_splits, 
-            args.train, args.test, args.dev, args.output_folder)
-
-        
+        num_sent = end - start
+        trn_end = int(train*num_sent)
+        tst_end = int((train + test)*num_sent)
+        yield i, ".trn", trn_end
+        yield i, ".tst", tst_end - trn_end
+        yield i, ".dev", num_sent - tst_end
+
+def split_manifest(num_all_sent, num_splits, train, test, dev, seed=None):
+    """
+    Splits shared by every sample file with num_all_sent line-aligned
+    sentences. Each output file is a [split, extension, start, end] range of
+    sentence positions; with a seed, positions index a shuffled order of the
+    sentences instead of the sample file itself
+    """
+    files = []
+    position = 0
+    for i, extension, num_sent in split_sizes(num_all_sent, num_splits,
+            train, test):
+        files.append([i, extension, position, position + num_sent])
+        position += num_sent
+    return {"num_sentences": num_all_sent, "num_splits": num_splits,
+        "train": train, "test": test, "dev": dev, "seed": seed,
+        "files": files}
+
+def sentence_order(manifest):
+    """Sentence ids in the order the manifest's positions refer to, or None"""
+    if manifest["seed"] is None:
+        return None
+    rng = np.random.default_rng(manifest["seed"])
+    return rng.permutation(manifest["num_sentences"])
+
+def line_offsets(data):
+    """Byte offset of the start of every line of data, then len(data)"""
+    if len(data) == 0:
+        return np.zeros(1, dtype=np.int64)
+    view = np.frombuffer(data, dtype=np.uint8)
+    starts = np.flatnonzero(view == ord("\n")) + 1
+    # a view must not outlive the mmap it was taken from
+    del view
+    if starts.size == 0 or starts[-1] != len(data):
+        starts = np.append(starts, len(data))
+    return np.concatenate(([0], starts))
+
+def copy_lines(source, output, n, block=1 << 16):
+    """
+    Copy the next n lines of source to output, or skip them if output is 
+    None. Returns how many lines source had left, up to n
+    """
+    copied = 0
+    while copied < n:
+        lines = list(itertools.islice(source, min(block, n - copied)))
+        if not lines:
+            break
+        if output is not None:
+            output.writelines(lines)
+        copied += len(lines)
+    return copied
+
+def grammar_of(sample_file):
+    """Grammar name of a sample_<grammar>.txt file, compressed or not"""
+    return strip_compression(sample_file)[:-4].split("/")[-1].split("_")[1]
+
+def create_splits(sample_file, manifest, output_folder, splits=None, 
+        compression=''):
+    """
+    Write the splits of one sample file listed in the manifest, or only the
+    splits numbered in splits, by slicing a memory-mapped copy of it at its 
+    line offsets. Without a seed the files are runs of lines in order, so a 
+    compressed sample file is split as it is decompressed; with one it is 
+    decompressed in full. Outputs are compressed if compression is an 
+    extension such as .gz
+    """
+    grammar_output = os.path.join(output_folder, grammar_of(sample_file))
+    os.makedirs(grammar_output, exist_ok=True)
+    order = sentence_order(manifest)
+    if order is None and compression_of(sample_file) != '':
+        # outputs only replace their files once the count is checked
+        with open_stream(sample_file, 'rb') as source, \
+                contextlib.ExitStack() as outputs:
+            read = 0
+            for i, extension, start, end in manifest["files"]:
+                output = None
+                if splits is None or i in splits:
+                    output = outputs.enter_context(open_replacing(
+                        os.path.join(grammar_output, 
+                        str(i) + extension + compression), 'wb'))
+                read += copy_lines(source, output, end - start)
+            read += sum(1 for _ in source)
+            if read != manifest["num_sentences"]:
+                raise ValueError(f"{sample_file} has {read} sentences, the "
+                    f"manifest {manifest['num_sentences']}")
+        return
+    with corpus_bytes(sample_file) as data:
+        offsets = line_offsets(data)
+        if len(offsets) - 1 != manifest["num_sentences"]:
+            raise ValueError(f"{sample_file} has {len(offsets) - 1} "
+                f"sentences, the manifest {manifest['num_sentences']}")
+        for i, extension, start, end in manifest["files"]:
+            if splits is not None and i not in splits:
+                continue
+            with open_replacing(os.path.join(grammar_output, 
+                    str(i) + extension + compression), 'wb') as output:
+                if order is None:
+                    output.write(data[offsets[start]:offsets[end]])
+                    continue
+                for s in order[start:end]:
+                    output.write(data[offsets[s]:offsets[s + 1]])
+
+def split_all(sample_files, manifest, output_folder, splits=None, workers=1,
+        compression=''):
+    """create_splits for every sample file, over workers processes"""
+    if compression == ".zst":
+        share_dictionary(sample_files[0], output_folder)
+    split_file = functools.partial(create_splits, manifest=manifest,
+        output_folder=output_folder, splits=splits, compression=compression)
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            for _ in pool.imap_unordered(split_file, sample_files):
+                pass
+    else:
+        for s in sample_files:
+            split_file(s)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Divide generated sentences into splits")
+
+    parser.add_argument("-s", "--sample_file", type=str, default='',
+        help="Path to sample file")
+    parser.add_argument("-S", "--sample_folder", type=str, default='',
+        help="Path to folder containing multiple sample files")
+    parser.add_argument("-O", "--output_folder", type=str, default='',
+        help="Location of output files")
+    parser.add_argument("-tr", "--train", type=float, default=0.8, 
+        help="Train proportion")
+    parser.add_argument("-ts", "--test", type=float, default=0.1, 
+        help="Test proportion")
+    parser.add_argument("-dv", "--dev", type=float, default=0.1, 
+        help="Dev proportion")
+    parser.add_argument("-n", "--num_splits", type=int, default=10, 
+        help="Number of splits")
+    parser.add_argument("--seed", type=int, default=None,
+        help="Shuffle sentences with this seed before splitting")
+    parser.add_argument("-w", "--workers", type=int, default=1, 
+        help="Number of sample files split at once")
+    parser.add_argument("-M", "--manifest", type=str, default='',
+        help="Read the splits from this manifest instead of computing them")
+    parser.add_argument("--write_manifest", type=str, default='',
+        help="Save the computed splits to this manifest")
+    parser.add_argument("--splits", type=str, default='',
+        help="Comma-separated split numbers to write, default all")
+    parser.add_argument("--cache_dir", type=str, default='',
+        help="Reuse splits cached here for the same sample files and manifest")
+    parser.add_argument("-z", "--compression", type=str, default='',
+        choices=['', '.gz', '.bz2', '.xz', '.zst'],
+        help="Compress the split files, by file extension")
+    add_ordering_arguments(parser)
+
+    args = parser.parse_args()
+
+    assert(args.train + args.test + args.dev == 1.0)
+
+    if args.sample_file == '' and args.sample_folder == '':
+        print("Please provide sample files")
+        sys.exit(1)
+    elif args.sample_file != '' and args.sample_folder != '':
+        print("Please provide either a single file OR a folder containing sample"
+            " files")
+        sys.exit(1)
+    elif args.sample_file != '':
+        sample_files = [args.sample_file]
+    elif args.orderings != "all":
+        _, grammars = selected_orderings(args)
+        sample_files = [find_corpus(os.path.join(args.sample_folder,
+            "sample_" + g + ".txt")) for g in grammars]
+    else:
+        sample_files = [os.path.join(args.sample_folder, f) for f in 
+            os.listdir(args.sample_folder) if is_corpus(f)]
+
+    # every sample file is a permutation of the same sentences, so the
+    # splits are worked out once for all of them
+    if args.manifest != '':
+        with open(args.manifest, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+    else:
+        manifest = split_manifest(count_lines(sample_files[0]),
+            args.num_splits, args.train, args.test, args.dev, args.seed)
+    if args.write_manifest != '':
+        saved = None
+        if os.path.exists(args.write_manifest):
+            with open(args.write_manifest, 'r') as manifest_file:
+                saved = json.load(manifest_file)
+        # an unchanged manifest keeps its time, as the training scripts
+        # rebuild datasets older than it
+        if saved != json.loads(json.dumps(manifest)):
+            with open_replacing(args.write_manifest, 'w') as manifest_file:
+                json.dump(manifest, manifest_file)
+
+    if args.output_folder != '':
+        splits = None
+        if args.splits != '':
+            splits = sorted(int(i) for i in args.splits.split(","))
+        run = lambda output_folder: split_all(sample_files, manifest, 
+            output_folder, splits, args.workers, args.compression)
+        if args.cache_dir == '':
+            run(args.output_folder)
+        else:
+            here = os.path.dirname(os.path.abspath(__file__))
+            run_cached(args.cache_dir, "make_splits", [os.path.join(here, f) 
+                for f in ("make_splits.py", "compressed.py", 
+                    os.path.join(os.pardir, "orderings.py"))], sample_files, 
+                {"manifest": manifest, "splits": splits, 
+                    "compression": args.compression, 
+                    "grammars": [grammar_of(s) for s in sample_files]}, 
+                args.output_folder, run)
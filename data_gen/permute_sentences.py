@@ -1,86 +1,244 @@
 import argparse
+import collections
+import contextlib
+import itertools
+import multiprocessing
 import os
 import sys
-import random
-import copy
-
-def flip_as_needed(i, sentence):
-    to_flip = [j + 1 for j in range(6) if (i >> j) & 1 == 1]
-    s_split = sentence.split(" ")
-    for j in range(len(s_split)):
-        if s_split[j][0].isnumeric():
-            if int(s_split[j][0]) in to_flip:
-                reversed_end = reversed_children(s_split[j+1:])
-                s_split = s_split[:j+1] + reversed_end
-        else:
-            continue
-    return ' '.join(s_split).strip("\n")
-
-def reversed_children(sentence_part):
-    children = []
-    bracket_stack = []
-    L_brack = '('
-    R_brack = ')'
-    children_end = -1
-    for i in range(len(sentence_part)):
-        s = sentence_part[i]
-        if s == L_brack:
-            bracket_stack.append((L_brack, i))
-        elif s == R_brack:
-            if len(bracket_stack) > 0:
-                if bracket_stack[-1][0] == L_brack:
-                    opening = bracket_stack.pop()
-                    if len(bracket_stack) == 0:
-                        children.append(sentence_part[opening[1]:i+1])
-            else:
-                children_end = i - 1
-                break
-        else:
-            continue
-    children_reversed = []
-    for c in children[::-1]:
-        children_reversed += c
-    return children_reversed + sentence_part[children_end:]
-
-def remove_bracketing(s):
-    new_s = []
-    split_s = s.split(" ")
+
+from artifact_cache import run_cached
+from compressed import (find_dictionary, open_replacing, open_stream, 
+    train_dictionary)
+from derivations import UNEXPANDED, DerivationFile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+    os.pardir))
+from orderings import add_ordering_arguments, selected_orderings
+
+def choice_point(label):
+    """Choice point marked by the digits at the start of a label, else 0"""
+    digits = len(label) - len(label.lstrip("0123456789"))
+    return int(label[:digits]) if digits else 0
+
+def linearizations(tokens, orderings=None):
+    """
+    Parse a bracketed sentence once and build its surface for every ordering,
+    or only for the ordering indices in orderings.
+    Returns (mask, surfaces): mask has bit j - 1 set for each choice point j
+    in the sentence, and surfaces maps each needed submask of mask to the 
+    words with those choice points flipped, joined by spaces. The surface for 
+    ordering i is surfaces[i & mask]
+    """
+    # each open constituent is [choice point bit, children] where a child is
+    # a (mask, surfaces) pair, words having mask 0
+    stack = [[0, []]]
     i = 0
-    while i < len(split_s):
-        if split_s[i] == ")":
-            i += 1
-        elif split_s[i] == "(":
+    while i < len(tokens):
+        t = tokens[i]
+        if t == "(":
+            c = choice_point(tokens[i + 1])
+            stack.append([1 << (c - 1) if c else 0, []])
             i += 2
+            continue
+        if t == ")":
+            own, children = stack.pop()
+            stack[-1][1].append(constituent_surfaces(own, children, 
+                orderings))
         else:
-            new_s.append(split_s[i])
-            i += 1
-    new_s.append(".")
-    return ' '.join(new_s)
-
-def generate_sentence_file(i, sentences, output_file):
-    output_f = open(output_file, 'w')
-    for s in sentences:
-        output_f.write(remove_bracketing(flip_as_needed(i, s)) + "\n")
-    output_f.close()
-
-parser = argparse.ArgumentParser(description="Generate variants of sentences"
-    " based on base grammar")
-
-parser.add_argument("-s", "--sentence_file", type=str, required=True, 
-    help="Path to base sentence file")
-
-parser.add_argument("-O", "--output_folder", type=str, required=True,
-    help="Location of output folder")
-
-args = parser.parse_args()
-
-file = open(args.sentence_file, 'r')
-sentences = file.readlines()
-
-for i in range(64):
-    if not os.path.exists(args.output_folder):
-        os.mkdir(args.output_folder) 
-    grammar_name = format(i, '06b')[::-1]
-    output_file = os.path.join(args.output_folder, 
-        "sample_" + grammar_name + ".txt")
-    generate_sentence_file(i, sentences, output_file)
\ No newline at end of file
+            stack[-1][1].append((0, {0: t}))
+        i += 1
+    return stack[0][1][0]
+
+def constituent_surfaces(own, children, orderings=None):
+    """
+    Surfaces of a constituent for every submask of the choice points in it,
+    or for those that some ordering in orderings projects onto
+    """
+    mask = own
+    for child_mask, _ in children:
+        mask |= child_mask
+    if orderings is None or mask == 0:
+        subs = submasks(mask)
+    else:
+        subs = {i & mask for i in orderings}
+    surfaces = {}
+    for sub in subs:
+        parts = [child[sub & child_mask] for child_mask, child in children]
+        if sub & own:
+            parts.reverse()
+        surfaces[sub] = ' '.join(parts)
+    return mask, surfaces
+
+def derivation_linearizations(derivations, rules, ends, orderings=None):
+    """
+    linearizations of one derivation of a DerivationFile, given its rule ids
+    and subtree ends. A node's children follow it in preorder, so walking the
+    nodes backwards finds every child's surfaces ready
+    """
+    rule_rhs = derivations.rule_rhs
+    rule_change = derivations.rule_change
+    node_surfaces = [None] * len(rules)
+    for node in range(len(rules) - 1, -1, -1):
+        rule = rules[node]
+        if rule == UNEXPANDED:
+            node_surfaces[node] = (0, {0: "..."})
+            continue
+        children = []
+        child = node + 1
+        for t in rule_rhs[rule]:
+            if t is None:
+                children.append(node_surfaces[child])
+                node_surfaces[child] = None
+                child = ends[child]
+            else:
+                children.append((0, {0: t}))
+        c = rule_change[rule]
+        node_surfaces[node] = constituent_surfaces(1 << (c - 1) if c > 0 
+            else 0, children, orderings)
+    return node_surfaces[0]
+
+def submasks(mask):
+    """Every submask of mask, mask itself first"""
+    sub = mask
+    while True:
+        yield sub
+        if sub == 0:
+            break
+        sub = (sub - 1) & mask
+
+# base derivations of the worker processes when the input is .npz
+_derivations = None
+
+def load_derivations(sentence_file):
+    global _derivations
+    _derivations = DerivationFile(sentence_file)
+
+def read_chunks(sentence_file, chunk_size):
+    """
+    Split the input into chunks: lists of bracketed lines, or (start, end) 
+    ranges of derivation indices for .npz input
+    """
+    if sentence_file.endswith('.npz'):
+        n = len(DerivationFile(sentence_file))
+        for start in range(0, n, chunk_size):
+            yield (start, min(start + chunk_size, n))
+    else:
+        with open_stream(sentence_file, 'r') as file:
+            while True:
+                lines = list(itertools.islice(file, chunk_size))
+                if not lines:
+                    break
+                yield lines
+
+def permute_chunk(chunk, orderings):
+    """Text of a chunk of sentences for each ordering index in orderings"""
+    if isinstance(chunk, tuple):
+        sentences = (derivation_linearizations(_derivations, 
+            *_derivations[i], orderings) for i in range(*chunk))
+    else:
+        sentences = (linearizations(line.split(), orderings) 
+            for line in chunk)
+    blocks = [[] for _ in orderings]
+    for mask, surfaces in sentences:
+        for i, block in zip(orderings, blocks):
+            block.append(surfaces[i & mask] + " .\n")
+    return [''.join(block) for block in blocks]
+
+def permuted_chunks(sentence_file, orderings, workers, chunk_size):
+    """
+    Yield permute_chunk results in input order. With several workers at most 
+    2 * workers chunks are in flight, so memory does not grow with the input
+    """
+    chunks = read_chunks(sentence_file, chunk_size)
+    if workers <= 1:
+        if sentence_file.endswith('.npz'):
+            load_derivations(sentence_file)
+        for chunk in chunks:
+            yield permute_chunk(chunk, orderings)
+        return
+    initializer = load_derivations if sentence_file.endswith('.npz') else None
+    with multiprocessing.Pool(workers, initializer, 
+            (sentence_file,)) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(permute_chunk, 
+                (chunk, orderings)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def permute_sentences(sentence_file, output_folder, space, grammar_names, 
+        workers, chunk_size, compression=''):
+    """
+    Write sample_<grammar>.txt to output_folder for each grammar named, 
+    compressed if compression is an extension such as .gz. zstd files share
+    a dictionary trained on the first chunk of every grammar, unless one is
+    already in place
+    """
+    if not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+    orderings = [space.index(grammar_name) for grammar_name in grammar_names]
+    paths = [os.path.join(output_folder, "sample_" + space.name(i) + ".txt"
+        + compression) for i in orderings]
+    output_files = None
+
+    # each output replaces its file once every chunk is written
+    with contextlib.ExitStack() as outputs:
+        for blocks in permuted_chunks(sentence_file, orderings, workers, 
+                chunk_size):
+            if output_files is None:
+                if compression == ".zst" and find_dictionary(paths[0]) is None:
+                    train_dictionary((line.encode() for block in blocks 
+                        for line in block.splitlines(True)), output_folder)
+                output_files = [outputs.enter_context(open_replacing(path)) 
+                    for path in paths]
+            for output_f, block in zip(output_files, blocks):
+                output_f.write(block)
+
+        if output_files is None:
+            for path in paths:
+                outputs.enter_context(open_replacing(path))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate variants of "
+        "sentences based on base grammar")
+
+    parser.add_argument("-s", "--sentence_file", type=str, required=True,
+        help="Path to base sentence file, bracketed text or .npz derivations")
+
+    parser.add_argument("-O", "--output_folder", type=str, required=True,
+        help="Location of output folder")
+
+    parser.add_argument("-w", "--workers", type=int, default=1,
+        help="Number of processes permuting chunks of sentences")
+
+    parser.add_argument("--chunk_size", type=int, default=10000,
+        help="Sentences per chunk")
+
+    add_ordering_arguments(parser)
+
+    parser.add_argument("--cache_dir", type=str, default='',
+        help="Reuse permuted samples cached here for the same input and "
+        "orderings")
+
+    parser.add_argument("-z", "--compression", type=str, default='',
+        choices=['', '.gz', '.bz2', '.xz', '.zst'],
+        help="Compress the permuted samples, by file extension")
+
+    args = parser.parse_args()
+
+    space, grammar_names = selected_orderings(args)
+    run = lambda output_folder: permute_sentences(args.sentence_file, 
+        output_folder, space, grammar_names, args.workers, args.chunk_size, 
+        args.compression)
+    if args.cache_dir == '':
+        run(args.output_folder)
+    else:
+        here = os.path.dirname(os.path.abspath(__file__))
+        run_cached(args.cache_dir, "permute_sentences", [os.path.join(here, f) 
+            for f in ("permute_sentences.py", "derivations.py", "compressed.py",
+                os.path.join(os.pardir, "orderings.py"))], 
+            [args.sentence_file], {"choice_points": args.choice_points, 
+                "orderings": args.orderings, "compression": args.compression}, 
+            args.output_folder, run)
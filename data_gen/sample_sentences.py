@@ -1,16 +1,33 @@
 import argparse
+import bisect
+import collections
+import hashlib
+import multiprocessing
 import os
 import random
 
+import numpy as np
+
+from artifact_cache import run_cached
+from compressed import open_replacing
+from derivations import (UNEXPANDED, DerivationWriter, subtree_ends, 
+    write_derivations)
+
+# marks the end of a bracketed constituent on the derivation stack
+CLOSE = -1
+
 
 class PCFG:
     """
     PCFG to sample sentences from
     """
-    def __init__(self, grammar_file):
+    def __init__(self, grammar_file, rng=None):
         self.rules = None
         self.change_rules = None
+        # the global random module unless a private generator is given
+        self.rng = rng if rng is not None else random
         self.load_rules(grammar_file)
+        self.compile_rules()
 
     def load_rules(self, grammar_file):
         new_rules = {}
@@ -43,117 +60,816 @@ class PCFG:
         self.rules = new_rules
         self.change_rules = change
 
+    def compile_rules(self):
+        """
+        Intern symbols and rules to integer ids so that a rule can be chosen 
+        with a bisect over cumulative probabilities instead of a linear walk
+        """
+        self.symbols = []
+        self.symbol_ids = {}
+        for lhs, poss in self.rules.items():
+            self.intern(lhs)
+            for rhs in poss:
+                for token in rhs[0].split(" "):
+                    self.intern(token)
+        self.is_nonterminal = [s in self.rules for s in self.symbols]
+
+        # per rule id: lhs id, rhs ids, rhs tokens and choice point (-1 if none)
+        self.rule_lhs = []
+        self.rule_rhs = []
+        self.rule_tokens = []
+        self.rule_change = []
+        # per nonterminal id: cumulative probabilities and their rule ids
+        self.cum_probs = [None] * len(self.symbols)
+        self.symbol_rules = [None] * len(self.symbols)
+        for lhs, poss in self.rules.items():
+            lhs_id = self.symbol_ids[lhs]
+            cum = []
+            rule_ids = []
+            val = 0.0
+            for rhs, prob in poss:
+                # accumulated in the same order as the original linear walk so
+                # that a given random draw selects exactly the same rule
+                val += prob
+                cum.append(val)
+                rule_ids.append(len(self.rule_lhs))
+                tokens = rhs.split(" ")
+                self.rule_lhs.append(lhs_id)
+                self.rule_rhs.append(tuple(self.symbol_ids[t] for t in tokens))
+                self.rule_tokens.append(tokens)
+                self.rule_change.append(
+                    self.change_rules.get(lhs + "\t" + rhs, -1))
+            self.cum_probs[lhs_id] = cum
+            self.symbol_rules[lhs_id] = rule_ids
+        self.rule_rhs_reversed = [rhs[::-1] for rhs in self.rule_rhs]
+        # rules listed more than once share the id of their first listing, so 
+        # equal rule sequences mean equal bracketed sentences
+        first_listing = {}
+        self.rule_canonical = [
+            first_listing.setdefault((lhs, rhs, change), rule) 
+            for rule, (lhs, rhs, change) in enumerate(
+                zip(self.rule_lhs, self.rule_rhs, self.rule_change))]
+        # label written after "(" in bracketed output, e.g. "2VP_Past_S"
+        self.rule_label = [
+            (change if change != -1 else "") + self.symbols[lhs]
+            for lhs, change in zip(self.rule_lhs, self.rule_change)]
+
+    def intern(self, symbol):
+        if symbol not in self.symbol_ids:
+            self.symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return self.symbol_ids[symbol]
+
+    def choose_rule(self, symbol_id):
+        cum = self.cum_probs[symbol_id]
+        # rounding can leave the final cumulative value just below 1.0, so
+        # clamp a draw above it to the last rule
+        i = bisect.bisect_left(cum, self.rng.random())
+        if i == len(cum):
+            i -= 1
+        return self.symbol_rules[symbol_id][i]
+
     def sample_sentence(self, max_expansions, bracketing):
+        bracketed, plain = self.sample_derivation(max_expansions)
+        if bracketing:
+            return bracketed
+        return plain
+
+    def sample_derivation(self, max_expansions):
+        """
+        Expand a derivation left to right using a stack of pending symbols, 
+        returning its bracketed and plain surfaces. Once more than 
+        max_expansions rules have been applied, any unexpanded nonterminal is 
+        written as "...". The rules applied are kept in preorder in 
+        self.derivation_rules, with UNEXPANDED for each "..."
+        """
+        symbols = self.symbols
+        is_nonterminal = self.is_nonterminal
+        rule_rhs_reversed = self.rule_rhs_reversed
+        rule_label = self.rule_label
+        rule_canonical = self.rule_canonical
+        choose_rule = self.choose_rule
+        bracketed = []
+        plain = []
+        rules = []
+        # the stack holds the rest of the sentence in reverse order, with 
+        # CLOSE marking where a bracketed constituent ends
+        stack = [self.symbol_ids["ROOT"]]
         self.expansions = 0
-        done = False
-        sent = ["ROOT"]
-        idx = 0
-        while not done:
-            if sent[idx] not in self.rules.keys():
-                idx += 1
-                if idx >= len(sent):
-                    done = True
-                continue
+        while stack:
+            symbol = stack.pop()
+            if symbol == CLOSE:
+                bracketed.append(")")
+            elif not is_nonterminal[symbol]:
+                bracketed.append(symbols[symbol])
+                plain.append(symbols[symbol])
+            elif self.expansions > max_expansions:
+                bracketed.append("...")
+                plain.append("...")
+                rules.append(UNEXPANDED)
             else:
-                replace, change_idx = self.expand(sent[idx])
-                if bracketing:
-                    if change_idx == -1:
-                        sent = (sent[:idx] 
-                            + ["(", sent[idx]] + replace + [")"]  
-                            + sent[idx + 1:])
-                    else:
-                        sent = (sent[:idx] 
-                            + ["(", change_idx + sent[idx]] + replace + [")"]  
-                            + sent[idx + 1:])
-                else:
-                    sent = sent[:idx] + replace  + sent[idx + 1:]
+                rule = choose_rule(symbol)
+                rules.append(rule_canonical[rule])
                 self.expansions += 1
-                if bracketing:
-                    idx += 2
-                if self.expansions > max_expansions:
-                    done = True
-                if idx >= len(sent):
-                    done = True
-        if self.expansions > max_expansions:
-            for idx in range(len(sent)):
-                if not bracketing:
-                    if sent[idx] in self.rules.keys():
-                        sent[idx] = "..."
-                else:
-                    if sent[idx] in self.rules.keys() and sent[idx - 1] != "(":
-                        sent[idx] = "..."
-        return ' '.join(sent)
+                bracketed.append("(")
+                bracketed.append(rule_label[rule])
+                stack.append(CLOSE)
+                stack.extend(rule_rhs_reversed[rule])
+        self.derivation_rules = rules
+        return ' '.join(bracketed), ' '.join(plain)
+
+    def sample_rules(self, max_expansions):
+        """Sample a derivation as a tuple of rule ids in preorder"""
+        self.sample_derivation(max_expansions)
+        return tuple(self.derivation_rules)
 
     def expand(self, symbol):
-        poss = self.rules[symbol]
-        sample = random.random()
-        val = 0.0
-        rhs = ""
-        idx = -1
-        for p in poss:
-            val += p[1]
-            if sample <= val:
-                if symbol + "\t" + p[0] in self.change_rules.keys():
-                    idx = self.change_rules[symbol + "\t" + p[0]]
-                rhs = p[0]
+        rule = self.choose_rule(self.symbol_ids[symbol])
+        return list(self.rule_tokens[rule]), self.rule_change[rule]
+
+    def compile_batch_tables(self):
+        """
+        Build the NumPy tables used by sample_batch. Batch text is written as 
+        units: words, ")", "...", and for each rule "( label" if it has 
+        nonterminal children or else its whole constituent, "( label words )"
+        """
+        n_symbols = len(self.symbols)
+        self.close_id = n_symbols
+        self.ellipsis_id = n_symbols + 1
+        self.rule_unit = n_symbols + 2 + np.arange(len(self.rule_rhs))
+        self.rule_unit_ids = self.rule_unit.tolist()
+        nonterminal = np.array(self.is_nonterminal)
+
+        # per rule: its nonterminal children, and for each of them how many 
+        # words of the rule come before it
+        self.rule_arity = np.zeros(len(self.rule_rhs), dtype=np.int64)
+        self.rule_words = np.zeros(len(self.rule_rhs), dtype=np.int64)
+        children = []
+        words_before = []
+        # per word of a rule with children: the child it follows (-1 for 
+        # none) and how many words lie between them
+        words = []
+        word_after = []
+        word_gap = []
+        units = []
+        plain_units = []
+        for rule, rhs in enumerate(self.rule_rhs):
+            rule_words = [t for t in rhs if not nonterminal[t]]
+            self.rule_words[rule] = len(rule_words)
+            self.rule_arity[rule] = len(rhs) - len(rule_words)
+            label = "( " + self.rule_label[rule]
+            if self.rule_arity[rule] == 0:
+                text = ' '.join(self.symbols[t] for t in rule_words)
+                units.append(label + " " + text + " )")
+                plain_units.append(text)
+                continue
+            units.append(label)
+            first_word = len(words)
+            plain_units.append("")
+            child = -1
+            gap = 0
+            for t in rhs:
+                if nonterminal[t]:
+                    children.append(t)
+                    words_before.append(len(words) - first_word)
+                    child += 1
+                    gap = 0
+                else:
+                    words.append(t)
+                    word_after.append(child)
+                    word_gap.append(gap)
+                    gap += 1
+        self.rule_child_start = np.cumsum(self.rule_arity) - self.rule_arity
+        self.child_symbol = np.array(children, dtype=np.int32)
+        self.child_words_before = np.array(words_before, dtype=np.int64)
+        # words of rules that also have children, which are written apart 
+        # from their rule's unit
+        self.rule_loose = np.where(self.rule_arity > 0, self.rule_words, 0)
+        self.rule_loose_start = np.cumsum(self.rule_loose) - self.rule_loose
+        self.loose_symbol = np.array(words, dtype=np.int32)
+        self.loose_after = np.array(word_after, dtype=np.int64)
+        self.loose_gap = np.array(word_gap, dtype=np.int64)
+        self.has_loose_words = len(words) > 0
+
+        # bytes of every unit followed by a space, back to back, for 
+        # batch_text; units without plain text are dropped from plain lines
+        vocab = self.symbols + [")", "..."] + units
+        plain = self.symbols + ["", "..."] + plain_units
+        self.unit_text = {}
+        for bracketing, texts in ((True, vocab), (False, plain)):
+            encoded = [t.encode() + b" " if t else b"" for t in texts]
+            length = np.array([len(e) for e in encoded])
+            self.unit_text[bracketing] = (length, np.cumsum(length) - length, 
+                np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+        self.rule_canonical_id = np.array(self.rule_canonical, dtype=np.int32)
+        # alias tables for all nonterminals in flat arrays, so each draw is 
+        # a constant time lookup
+        self.nt_start = np.zeros(n_symbols, dtype=np.int64)
+        self.nt_count = np.zeros(n_symbols, dtype=np.int64)
+        alias_prob = []
+        alias_rule = []
+        own_rule = []
+        for symbol_id in range(n_symbols):
+            if self.is_nonterminal[symbol_id]:
+                rule_ids = self.symbol_rules[symbol_id]
+                self.nt_start[symbol_id] = len(alias_prob)
+                self.nt_count[symbol_id] = len(rule_ids)
+                probs = [self.rules[self.symbols[symbol_id]][i][1] 
+                    for i in range(len(rule_ids))]
+                prob, alias = alias_table(probs)
+                alias_prob += prob
+                alias_rule += [rule_ids[i] for i in alias]
+                own_rule += rule_ids
+        self.alias_prob = np.array(alias_prob)
+        # the rule kept by column i at i, and its alias at i + len(alias)
+        self.alias_rules = np.array(own_rule + alias_rule)
+
+    def draw_rules(self, symbol_ids, rng):
+        """Choose a rule for every symbol with vectorized alias lookups"""
+        u = rng.random(len(symbol_ids)) * self.nt_count[symbol_ids]
+        column = u.astype(np.int64)
+        idx = self.nt_start[symbol_ids] + column
+        idx[u - column >= self.alias_prob[idx]] += len(self.alias_prob)
+        return self.alias_rules[idx]
+
+    def batch_tree(self, k, max_expansions, rng, tokens=False):
+        """
+        Expand k derivations at once, a level of nonterminal nodes at a 
+        time. Nodes are numbered level by level, so the children of node i 
+        are the arity[i] nodes from first_child[i].
+
+        Returns a dict of node arrays: symbol, rule, arity, first_child, 
+        derivation and size, the nodes in each subtree, and with tokens set 
+        token_size, its batch tokens. It also holds level_starts and the 
+        overflowing derivations: those needing more than max_expansions + 1 
+        expansions stop growing, with rule -1 for the nodes left undrawn, 
+        and are finished by overflow_derivation
+        """
+        if not hasattr(self, "alias_rules"):
+            self.compile_batch_tables()
+        level_starts = [0]
+        level_symbols = [np.full(k, self.symbol_ids["ROOT"], dtype=np.int32)]
+        level_derivs = [np.arange(k)]
+        level_rules = []
+        level_arity = []
+        expansions = np.zeros(k, dtype=np.int64)
+        overflow = np.zeros(k, dtype=bool)
+        while len(level_symbols[-1]):
+            symbols, derivs = level_symbols[-1], level_derivs[-1]
+            level_starts.append(level_starts[-1] + len(symbols))
+            # the nodes of a derivation form a run, as derivs is sorted
+            first = np.flatnonzero(np.diff(derivs, prepend=-1))
+            runs = derivs[first]
+            expansions[runs] += np.diff(first, append=len(derivs))
+            grown = runs[expansions[runs] > max_expansions + 1]
+            if len(grown):
+                overflow[grown] = True
+                drawn = ~overflow[derivs]
+                rules = np.full(len(symbols), -1)
+                rules[drawn] = self.draw_rules(symbols[drawn], rng)
+                arity = np.where(drawn, self.rule_arity[rules], 0)
+            else:
+                rules = self.draw_rules(symbols, rng)
+                arity = self.rule_arity[rules]
+            level_rules.append(rules)
+            level_arity.append(arity)
+            # index of each child among its parent's children
+            starts = np.repeat(np.cumsum(arity) - arity, arity)
+            child = np.arange(len(starts)) - starts
+            level_symbols.append(self.child_symbol[np.repeat(
+                self.rule_child_start[rules], arity) + child])
+            level_derivs.append(np.repeat(derivs, arity))
+        arity = np.concatenate(level_arity)
+        rules = np.concatenate(level_rules)
+        tree = {'symbol': np.concatenate(level_symbols), 'rule': rules, 
+            'arity': arity, 'first_child': k + np.cumsum(arity) - arity,
+            'derivation': np.concatenate(level_derivs), 
+            'level_starts': level_starts, 
+            'overflow': np.flatnonzero(overflow)}
+
+        # subtree sizes, from the deepest level up
+        sizes = {'size': np.ones(len(rules), dtype=np.int64)}
+        if tokens:
+            # a node with children writes its unit, loose words and ")", 
+            # and any other node a single unit
+            sizes['token_size'] = np.where(arity > 0, 
+                2 + self.rule_loose[rules], 1)
+        levels = list(zip(level_starts[:-2], level_starts[1:-1], 
+            level_starts[2:]))
+        for start, middle, end in reversed(levels):
+            parents = start + np.flatnonzero(arity[start:middle])
+            first = tree['first_child'][parents] - middle
+            for size in sizes.values():
+                size[parents] += np.add.reduceat(size[middle:end], first)
+        tree.update(sizes)
+        return tree
+
+    def batch_positions(self, tree, roots, sizes, tokens=False):
+        """
+        Where each node of a batch_tree goes in a flat output holding each 
+        derivation's nodes (or with tokens set, its batch tokens) in 
+        preorder, derivation i from roots[i]. sizes are the matching 
+        subtree sizes
+        """
+        arity = tree['arity']
+        first_child = tree['first_child']
+        level_starts = tree['level_starts']
+        pos = np.empty(len(arity), dtype=np.int64)
+        pos[:len(roots)] = roots
+        for start, middle, end in zip(level_starts[:-2], level_starts[1:-1], 
+                level_starts[2:]):
+            parents = start + np.flatnonzero(arity[start:middle])
+            n = arity[parents]
+            # tokens or nodes of the earlier children of the same parent
+            before = np.cumsum(sizes[middle:end]) - sizes[middle:end]
+            before -= np.repeat(before[first_child[parents] - middle], n)
+            pos[middle:end] = np.repeat(pos[parents] + 1, n) + before
+            if tokens and self.has_loose_words:
+                child = np.arange(end - middle) - np.repeat(
+                    first_child[parents] - middle, n)
+                pos[middle:end] += self.child_words_before[np.repeat(
+                    self.rule_child_start[tree['rule'][parents]], n) + child]
+        return pos
+
+    def overflow_derivation(self, tree, derivation, max_expansions, rng):
+        """
+        Rule ids and batch tokens of an overflowing derivation in preorder, 
+        drawing rules for nodes the batch left undrawn and writing "..." for 
+        every nonterminal after the first max_expansions + 1 expansions
+        """
+        symbols = tree['symbol']
+        node_rules = tree['rule']
+        first_child = tree['first_child']
+        rules = []
+        tokens = []
+        expansions = 0
+        # node ids are pushed as they are, symbols that are not part of the 
+        # tree as -(symbol + 2) and the end of a constituent as CLOSE
+        stack = [derivation]
+        while stack:
+            item = stack.pop()
+            if item == CLOSE:
+                tokens.append(self.close_id)
+                continue
+            symbol = int(symbols[item]) if item >= 0 else -item - 2
+            if not self.is_nonterminal[symbol]:
+                tokens.append(symbol)
+                continue
+            if expansions > max_expansions:
+                tokens.append(self.ellipsis_id)
+                rules.append(UNEXPANDED)
+                continue
+            expansions += 1
+            rule = int(node_rules[item]) if item >= 0 else -1
+            if rule >= 0:
+                child = int(first_child[item])
+                items = []
+                for t in self.rule_rhs[rule]:
+                    if self.is_nonterminal[t]:
+                        items.append(child)
+                        child += 1
+                    else:
+                        items.append(-t - 2)
+            else:
+                cum = self.cum_probs[symbol]
+                i = min(bisect.bisect_left(cum, rng.random()), len(cum) - 1)
+                rule = self.symbol_rules[symbol][i]
+                items = [-t - 2 for t in self.rule_rhs[rule]]
+            rules.append(self.rule_canonical[rule])
+            tokens.append(self.rule_unit_ids[rule])
+            if self.rule_arity[rule]:
+                stack.append(CLOSE)
+                stack.extend(reversed(items))
+        return rules, tokens
+
+    def batch_layout(self, tree, k, max_expansions, rng, tokens):
+        """
+        Offsets of k derivations of a batch_tree in a flat output of their 
+        nodes or batch tokens, with the finished overflowing derivations and 
+        the positions and mask of the nodes of the others
+        """
+        sizes = tree['token_size' if tokens else 'size']
+        lengths = sizes[:k].copy()
+        finished = {}
+        for i in tree['overflow'].tolist():
+            finished[i] = self.overflow_derivation(tree, i, max_expansions, 
+                rng)[tokens]
+            lengths[i] = len(finished[i])
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        pos = self.batch_positions(tree, offsets[:-1], sizes, tokens)
+        nodes = slice(None)
+        if len(finished):
+            nodes = ~np.isin(tree['derivation'], tree['overflow'])
+        return offsets, finished, pos, nodes
+
+    def sample_batch(self, k, max_expansions, rng=None):
+        """
+        Sample k derivations at once. Returns their rule ids and subtree 
+        ends as write_derivations stores them, with derivation i at 
+        [offsets[i]:offsets[i + 1]]
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        tree = self.batch_tree(k, max_expansions, rng)
+        offsets, finished, pos, nodes = self.batch_layout(tree, k, 
+            max_expansions, rng, False)
+        rules = np.empty(offsets[-1], dtype=np.int32)
+        ends = np.empty(offsets[-1], dtype=np.int32)
+        at = pos[nodes]
+        rules[at] = self.rule_canonical_id[tree['rule'][nodes]]
+        ends[at] = at - offsets[tree['derivation'][nodes]] + tree['size'][nodes]
+        for i, derivation in finished.items():
+            rules[offsets[i]:offsets[i + 1]] = derivation
+            ends[offsets[i]:offsets[i + 1]] = subtree_ends(derivation, 
+                self.rule_arity)
+        return rules, ends, offsets
+
+    def sample_batch_tokens(self, k, max_expansions, rng=None):
+        """
+        Sample k derivations at once. Returns their batch tokens, which 
+        batch_text writes out, with derivation i at 
+        tokens[offsets[i]:offsets[i + 1]]
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        tree = self.batch_tree(k, max_expansions, rng, tokens=True)
+        offsets, finished, pos, nodes = self.batch_layout(tree, k, 
+            max_expansions, rng, True)
+        tokens = np.empty(offsets[-1], dtype=np.int32)
+        rules = tree['rule'][nodes]
+        at = pos[nodes]
+        tokens[at] = self.rule_unit[rules]
+        inner = tree['arity'][nodes] > 0
+        tokens[at[inner] + tree['token_size'][nodes][inner] - 1] = self.close_id
+        if self.has_loose_words:
+            # words of rules with children, after the unit or after the 
+            # child they follow
+            n_words = self.rule_loose[rules]
+            word = np.repeat(self.rule_loose_start[rules], n_words) + (
+                np.arange(n_words.sum()) - np.repeat(np.cumsum(n_words) 
+                - n_words, n_words))
+            word_at = np.repeat(at, n_words) + 1 + self.loose_gap[word]
+            after = self.loose_after[word]
+            follows = after >= 0
+            child = np.repeat(tree['first_child'][nodes], n_words)[follows] \
+                + after[follows]
+            word_at[follows] += (pos[child] + tree['token_size'][child] 
+                - np.repeat(at, n_words)[follows] - 1)
+            tokens[word_at] = self.loose_symbol[word]
+        for i, derivation in finished.items():
+            tokens[offsets[i]:offsets[i + 1]] = derivation
+        return tokens, offsets
+
+    def batch_text(self, tokens, offsets, bracketing):
+        """Lines of sample_batch_tokens output as bytes"""
+        if not hasattr(self, "alias_rules"):
+            self.compile_batch_tables()
+        length, start, text = self.unit_text[bracketing]
+        lengths = length[tokens]
+        if not bracketing:
+            keep = lengths > 0
+            offsets = np.concatenate(([0], np.cumsum(keep)))[offsets]
+            tokens = tokens[keep]
+            lengths = lengths[keep]
+        ends = np.cumsum(lengths)
+        lines = text[np.repeat(start[tokens] - ends + lengths, lengths) 
+            + np.arange(ends[-1] if len(ends) else 0)]
+        # the space after the last unit of each line becomes its newline
+        lines[ends[offsets[1:] - 1] - 1] = ord("\n")
+        return lines.tobytes()
+
+def alias_table(probs):
+    """
+    Vose's alias method: column i keeps its own outcome with probability 
+    prob[i] and otherwise gives alias[i]
+    """
+    n = len(probs)
+    scaled = [p * n for p in probs]
+    prob = [1.0] * n
+    alias = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    return prob, alias
+
+def derive_seed(seed, *stream):
+    """
+    Derive an independent seed for one stream (e.g. a round and worker) of a 
+    seeded run
+    """
+    key = ":".join(str(x) for x in (seed,) + stream)
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], 'big')
+
+def sample_one(grammar, m, bracketing, binary):
+    """A sentence string, or a tuple of rule ids when binary is set"""
+    if binary:
+        return grammar.sample_rules(m)
+    return grammar.sample_sentence(m, bracketing)
+
+def sample_unique(grammar_file, n, m, bracketing, max_attempts, seed, 
+        binary=False):
+    """
+    Sample up to n unique sentences with a private generator, returning them 
+    in the order they were first drawn along with the attempts used
+    """
+    grammar = PCFG(grammar_file, random.Random(seed))
+    unique_sentences = {}
+    attempts = 0
+    while len(unique_sentences) < n and attempts < max_attempts:
+        sentence = sample_one(grammar, m, bracketing, binary)
+        unique_sentences[sentence] = None
+        attempts += 1
+    return list(unique_sentences), attempts
+
+def sample_parallel(grammar_file, n, m, bracketing, max_attempts, workers, 
+        seed, binary=False):
+    """
+    Spread sampling over a pool of workers. Each round asks every worker for 
+    its share of the sentences still needed, and results are merged in worker 
+    order so the output only depends on (seed, workers)
+    """
+    unique_sentences = {}
+    attempts = 0
+    round_idx = 0
+    with multiprocessing.Pool(workers) as pool:
+        while len(unique_sentences) < n and attempts < max_attempts:
+            needed = n - len(unique_sentences)
+            budget = max_attempts - attempts
+            jobs = []
+            for w in range(workers):
+                count = needed // workers + (w < needed % workers)
+                worker_budget = budget // workers + (w < budget % workers)
+                if count > 0 and worker_budget > 0:
+                    jobs.append((grammar_file, count, m, bracketing, 
+                        worker_budget, derive_seed(seed, round_idx, w), 
+                        binary))
+            for sentences, worker_attempts in pool.starmap(sample_unique, jobs):
+                attempts += worker_attempts
+                for sentence in sentences:
+                    if len(unique_sentences) < n:
+                        unique_sentences[sentence] = None
+            round_idx += 1
+    return list(unique_sentences), attempts
+
+_grammar_cache = {}
+
+def cached_grammar(grammar_file):
+    """Load each grammar once per process"""
+    if grammar_file not in _grammar_cache:
+        _grammar_cache[grammar_file] = PCFG(grammar_file)
+    return _grammar_cache[grammar_file]
+
+def sample_chunk(grammar_file, size, m, bracketing, seed, binary=False, 
+        vectorized=False):
+    """
+    Sample a chunk of sentences, duplicates included. A vectorized chunk is 
+    sampled by PCFG.sample_batch: its text as bytes, or with binary set the 
+    rules, ends and offsets arrays of its derivations
+    """
+    grammar = cached_grammar(grammar_file)
+    if vectorized:
+        rng = np.random.default_rng(seed)
+        if binary:
+            return grammar.sample_batch(size, m, rng)
+        return grammar.batch_text(*grammar.sample_batch_tokens(size, m, rng), 
+            bracketing)
+    grammar.rng = random.Random(seed)
+    return [sample_one(grammar, m, bracketing, binary) for _ in range(size)]
+
+def iter_chunks(grammar_file, chunk_size, m, bracketing, workers, seed, 
+        binary=False, vectorized=False):
+    """
+    Yield sampled chunks in a fixed order, with chunk i seeded by 
+    (seed, i). With several workers at most 2 * workers chunks are in flight
+    """
+    if workers <= 1:
+        i = 0
+        while True:
+            yield sample_chunk(grammar_file, chunk_size, m, bracketing, 
+                derive_seed(seed, "chunk", i), binary, vectorized)
+            i += 1
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            pending = collections.deque()
+            i = 0
+            while True:
+                while len(pending) < 2 * workers:
+                    pending.append(pool.apply_async(sample_chunk, (
+                        grammar_file, chunk_size, m, bracketing, 
+                        derive_seed(seed, "chunk", i), binary, vectorized)))
+                    i += 1
+                yield pending.popleft().get()
+
+def sentence_digest(sentence):
+    """8 byte digest used to deduplicate without keeping sentence strings"""
+    if isinstance(sentence, str):
+        data = sentence.encode()
+    elif isinstance(sentence, (bytes, memoryview)):
+        data = sentence
+    else:
+        data = np.array(sentence, dtype=np.int32).tobytes()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+def batch_digests(rules, offsets):
+    """sentence_digest of each derivation returned by PCFG.sample_batch"""
+    data = memoryview(rules.astype(np.int32).tobytes())
+    bounds = (4 * offsets).tolist()
+    return [sentence_digest(data[start:end]) 
+        for start, end in zip(bounds[:-1], bounds[1:])]
+
+def select_derivations(rules, ends, offsets, indices):
+    """Rules, ends and offsets of the derivations numbered in indices"""
+    indices = np.array(indices, dtype=np.int64)
+    lengths = offsets[indices + 1] - offsets[indices]
+    new_offsets = np.concatenate(([0], np.cumsum(lengths)))
+    positions = np.repeat(offsets[indices] - new_offsets[:-1], lengths) \
+        + np.arange(new_offsets[-1])
+    return rules[positions], ends[positions], new_offsets
+
+def sample_streaming(grammar_file, n, m, output_path, bracketing, workers, 
+        seed, chunk_size, min_acceptance, binary=False, vectorized=False):
+    """
+    Append unique sentences to output_path as they are sampled. Rather than 
+    a fixed attempt budget, sampling stops once the fraction of new sentences 
+    in a chunk falls below min_acceptance. Binary derivations are appended a 
+    chunk at a time by a DerivationWriter, so an interrupted run keeps the 
+    chunks accepted before it stopped
+    """
+    seen = set()
+    accepted = 0
+    attempts = 0
+    chunks_used = 0
+    if binary:
+        output = DerivationWriter(output_path, cached_grammar(grammar_file))
+    else:
+        output = open_replacing(output_path, 'w', keep=True)
+    with output as output:
+        chunks = iter_chunks(grammar_file, chunk_size, m, bracketing, 
+            workers, seed, binary, vectorized)
+        for chunk in chunks:
+            if vectorized and binary:
+                digests = batch_digests(chunk[0], chunk[2])
+            else:
+                if vectorized:
+                    chunk = chunk.decode().split("\n")[:-1]
+                digests = map(sentence_digest, chunk)
+            chunk_attempts = 0
+            new_indices = []
+            for i, digest in enumerate(digests):
+                if accepted >= n:
+                    break
+                chunk_attempts += 1
+                if digest not in seen:
+                    seen.add(digest)
+                    new_indices.append(i)
+                    accepted += 1
+            if vectorized and binary:
+                output.write_arrays(*select_derivations(*chunk, new_indices))
+            elif binary:
+                output.write([chunk[i] for i in new_indices])
+            else:
+                output.write(''.join(chunk[i] + "\n" for i in new_indices))
+                output.flush()
+            chunk_accepted = len(new_indices)
+            attempts += chunk_attempts
+            chunks_used += 1
+            if accepted >= n or chunk_accepted < min_acceptance * chunk_attempts:
                 break
-        return rhs.split(" "), idx
+        chunks.close()
+    print(f"Accepted {accepted} of {attempts} sampled sentences "
+        f"({accepted / max(attempts, 1):.2%}) over {chunks_used} chunks; "
+        f"acceptance in last chunk {chunk_accepted / max(chunk_attempts, 1):.2%}")
+    return accepted, attempts
 
-def sample_sentences(grammar_file, n, m, output_folder, bracketing):
+def sample_sentences(grammar_file, n, m, output_folder, bracketing, workers=1, 
+        seed=None, stream=False, chunk_size=10000, min_acceptance=0.01, 
+        binary=False, vectorized=False):
     if not os.path.exists(output_folder):
             os.mkdir(output_folder)        
     grammar_name = grammar_file[:-3].split("/")[-1]
-    output_file = open(os.path.join(output_folder, 
-        "sample_" + grammar_name + ".txt") , 'w')
-    grammar = PCFG(grammar_file)
+    output_path = os.path.join(output_folder, 
+        "sample_" + grammar_name + (".npz" if binary else ".txt"))
+    # vectorized sampling is only done in chunks
+    stream = stream or vectorized
+    if (workers > 1 or stream) and seed is None:
+        seed = random.randrange(2**32)
+        print(f"Sampling with seed {seed}")
+
+    if stream:
+        accepted, attempts = sample_streaming(grammar_file, n, m, output_path, 
+            bracketing, workers, seed, chunk_size, min_acceptance, binary, 
+            vectorized)
+        if accepted < n:
+            print(f"Warning: Could only generate {accepted} unique sentences after {attempts} attempts")
+        return
 
-    # keep track of unique sentences
-    unique_sentences = set()
+    # keep track of unique sentences, in the order they were first drawn so
+    # that a seeded run writes the same file
+    unique_sentences = {}
     attempts = 0
     max_attempts = n * 2  # allow some extra attempts to account for duplicates
 
-    while len(unique_sentences) < n and attempts < max_attempts:
-        sentence = grammar.sample_sentence(m, bracketing)
-        unique_sentences.add(sentence)
-        attempts += 1
+    if workers > 1:
+        unique_sentences, attempts = sample_parallel(grammar_file, n, m, 
+            bracketing, max_attempts, workers, seed, binary)
+    else:
+        grammar = PCFG(grammar_file)
+        while len(unique_sentences) < n and attempts < max_attempts:
+            sentence = sample_one(grammar, m, bracketing, binary)
+            unique_sentences[sentence] = None
+            attempts += 1
 
     # write unique sentences to file
-    for sentence in unique_sentences:
-        output_file.write(sentence + "\n")
+    if binary:
+        write_derivations(output_path, cached_grammar(grammar_file), 
+            unique_sentences)
+    else:
+        with open_replacing(output_path, 'w') as output_file:
+            for sentence in unique_sentences:
+                output_file.write(sentence + "\n")
 
     if len(unique_sentences) < n:
         print(f"Warning: Could only generate {len(unique_sentences)} unique sentences after {attempts} attempts")
 
 
-parser = argparse.ArgumentParser(description="Sample sentences from PCFG")
-
-parser.add_argument("-g", "--grammar_file", type=str, default='',
-    help="Path to grammar file")
-parser.add_argument("-G", "--grammar_folder", type=str, default='',
-    help="Path to folder containing multiple grammar files")
-parser.add_argument("-n", "--number_samples", type=int, required=True, 
-    help="Number of sentences to sample")
-parser.add_argument("-m", "--max_expansions", type=int, default=400, 
-    help="Max number of expansions performed")
-parser.add_argument("-O", "--output_folder", type=str, 
-    help="Location of output files")
-parser.add_argument("-b", "--bracketing", type=bool, 
-    help="Include bracketing of constituents")
-
-args = parser.parse_args()
-
-if args.grammar_file == '' and args.grammar_folder == '':
-    print("Please provide grammar files")
-elif args.grammar_file != '' and args.grammar_folder != '':
-    print("Please provide either a single file OR a folder containing grammar"
-        " files")
-elif args.grammar_file != '':
-    sample_sentences(args.grammar_file, args.number_samples, 
-        args.max_expansions, args.output_folder, args.bracketing)
-elif args.grammar_folder != '':
-    grammar_files = [f for f in os.listdir(
-        args.grammar_folder) if f.endswith('.gr')]
-    for g in grammar_files:
-        sample_sentences(os.path.join(args.grammar_folder, g), 
-            args.number_samples, args.max_expansions, args.output_folder, 
-            args.bracketing)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sample sentences from PCFG")
+
+    parser.add_argument("-g", "--grammar_file", type=str, default='',
+        help="Path to grammar file")
+    parser.add_argument("-G", "--grammar_folder", type=str, default='',
+        help="Path to folder containing multiple grammar files")
+    parser.add_argument("-n", "--number_samples", type=int, required=True, 
+        help="Number of sentences to sample")
+    parser.add_argument("-m", "--max_expansions", type=int, default=400, 
+        help="Max number of expansions performed")
+    parser.add_argument("-O", "--output_folder", type=str, 
+        help="Location of output files")
+    parser.add_argument("-b", "--bracketing", type=bool, 
+        help="Include bracketing of constituents")
+    parser.add_argument("--seed", type=int, default=None, 
+        help="Random seed used for sampling")
+    parser.add_argument("-w", "--workers", type=int, default=1, 
+        help="Number of sampling processes")
+    parser.add_argument("--stream", action="store_true", 
+        help="Write sentences as they are sampled, deduplicating on digests")
+    parser.add_argument("--chunk_size", type=int, default=10000, 
+        help="Sentences sampled per chunk in streaming mode")
+    parser.add_argument("--min_acceptance", type=float, default=0.01, 
+        help="Stop streaming once a chunk accepts less than this fraction")
+    parser.add_argument("--binary", action="store_true", 
+        help="Write derivations as rule ids to an .npz file instead of text")
+    parser.add_argument("--vectorized", action="store_true", 
+        help="Sample each chunk with PCFG.sample_batch (implies --stream)")
+    parser.add_argument("--cache_dir", type=str, default='', 
+        help="Reuse samples cached here for the same grammar, parameters and "
+        "seed (requires --seed)")
+
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    def sample_grammar(grammar_file):
+        params = {k: getattr(args, k) for k in ("number_samples", 
+            "max_expansions", "bracketing", "workers", "seed", "stream", 
+            "chunk_size", "min_acceptance", "binary", "vectorized")}
+        # the output file is named after the grammar file
+        params["grammar"] = os.path.basename(grammar_file)
+        run = lambda output_folder: sample_sentences(grammar_file, 
+            args.number_samples, args.max_expansions, output_folder, 
+            args.bracketing, args.workers, args.seed, args.stream, 
+            args.chunk_size, args.min_acceptance, args.binary, 
+            args.vectorized)
+        if args.cache_dir == '' or args.seed is None:
+            run(args.output_folder)
+            return
+        # each grammar starts from the seed so that its sample depends only 
+        # on its own key
+        random.seed(args.seed)
+        here = os.path.dirname(os.path.abspath(__file__))
+        run_cached(args.cache_dir, "sample_sentences", [os.path.join(here, f) 
+            for f in ("sample_sentences.py", "derivations.py", "compressed.py")], 
+            [grammar_file], params, args.output_folder, run)
+
+    if args.grammar_file == '' and args.grammar_folder == '':
+        print("Please provide grammar files")
+    elif args.grammar_file != '' and args.grammar_folder != '':
+        print("Please provide either a single file OR a folder containing "
+            "grammar files")
+    elif args.grammar_file != '':
+        sample_grammar(args.grammar_file)
+    elif args.grammar_folder != '':
+        grammar_files = [f for f in os.listdir(
+            args.grammar_folder) if f.endswith('.gr')]
+        for g in grammar_files:
+            sample_grammar(os.path.join(args.grammar_folder, g))
@@ -1,49 +1,83 @@
 import argparse
+import heapq
 import os
 
-def total_sentence_score(words):
-    score = 0
-    for w in words:
-        score += float(w.split(' ')[1][1:-1])
-    return score
-
-parser = argparse.ArgumentParser(
-    description = "Get sentence scores from eval output file")
-
-parser.add_argument("-i", "--input_file", type=str, required=True, 
-    help="Path to input file")
-
-parser.add_argument("-O", "--output_folder", type=str, required=True,
-    help="Location of output folder")
-
-args = parser.parse_args()
-
-if not os.path.exists(args.output_folder):
-    os.mkdir(args.output_folder)
-
-file = open(args.input_file, 'r')
-all_lines = file.readlines()
-all_lines = [l for l in all_lines if len(l.split('|')) > 3]
-word_score_lines = [l.split('|')[3][1:] for l in all_lines if l.split(
-    '|')[3].split(' ')[1].isnumeric()]
-word_score_lines.sort(key=lambda a:int(a.split(' ')[0]))
-full_text = ""
-for line in word_score_lines:
-    full_text += ' '.join(line.split(' ')[1:]).strip('\n') + " "
-sentences = []
-start = 0
-words = full_text.split("\t")
-for i in range(len(words)):
-    if words[i].split(' ')[0] == "</s>":
-        sentences.append(words[start:i+1])
-        start = i+1
-sentence_scores = []
-for s in sentences:
-    sentence_scores.append(total_sentence_score(s))
-grammar, split, dev_test, _ = args.input_file.split("/")[-1].split(".")
-if not os.path.exists(os.path.join(args.output_folder, grammar)):
-    os.mkdir(os.path.join(args.output_folder, grammar))
-output_file = open(os.path.join(args.output_folder, grammar, 
-    ".".join([split, dev_test, "txt"])), 'w')
-for s in sentence_scores:
-    output_file.write(str(s) + "\n")
+def word_score_lines(lines, max_pending=4096):
+    """
+    Yield the "word [score]" fields of the word-probability lines of an
+    eval-lm log, one list per line, in order of their sample index. Lines
+    logged out of order wait in a buffer of at most max_pending lines; when
+    it is full the lowest index is emitted even if an earlier one is missing
+    """
+    pending = []
+    next_index = 0
+    for count, line in enumerate(lines):
+        parts = line.split('|', 4)
+        if len(parts) < 4:
+            continue
+        index, _, fields = parts[3][1:].partition(' ')
+        if not index.isnumeric():
+            continue
+        heapq.heappush(pending, (int(index), count, fields.rstrip('\n')))
+        while pending and (pending[0][0] <= next_index
+                or len(pending) > max_pending):
+            index, _, fields = heapq.heappop(pending)
+            next_index = index + 1
+            yield fields.split('\t')
+    while pending:
+        yield heapq.heappop(pending)[2].split('\t')
+
+def sentence_word_scores(lines, max_pending=4096):
+    """
+    Yield the words and word scores of each sentence, ended by </s>, of an
+    eval-lm log given as an iterable of lines
+    """
+    words = []
+    scores = []
+    for fields in word_score_lines(lines, max_pending):
+        for w in fields:
+            word, score_text = w.split(' ')[:2]
+            words.append(word)
+            scores.append(float(score_text[1:-1]))
+            if word == "</s>":
+                yield words, scores
+                words = []
+                scores = []
+
+def sentence_scores(lines, max_pending=4096):
+    """
+    Yield the total score of each sentence, ended by </s>, of an eval-lm
+    log given as an iterable of lines
+    """
+    for _, scores in sentence_word_scores(lines, max_pending):
+        score = 0.0
+        for s in scores:
+            score += s
+        yield score
+
+def write_sentence_scores(input_file, output_folder):
+    """
+    Write the sentence scores of the log <grammar>.<split>.<dev|test>.txt
+    to output_folder/<grammar>/<split>.<dev|test>.txt
+    """
+    grammar, split, dev_test, _ = input_file.split("/")[-1].split(".")
+    os.makedirs(os.path.join(output_folder, grammar), exist_ok=True)
+    with open(input_file, 'r') as log, open(os.path.join(output_folder,
+            grammar, ".".join([split, dev_test, "txt"])), 'w',
+            buffering=1 << 20) as output_file:
+        for s in sentence_scores(log):
+            output_file.write(str(s) + "\n")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = "Get sentence scores from eval output file")
+
+    parser.add_argument("-i", "--input_file", type=str, required=True,
+        help="Path to input file")
+
+    parser.add_argument("-O", "--output_folder", type=str, required=True,
+        help="Location of output folder")
+
+    args = parser.parse_args()
+
+    write_sentence_scores(args.input_file, args.output_folder)
@@ -0,0 +1,260 @@
+import argparse
+import collections
+import glob
+import multiprocessing
+import os
+
+import numpy as np
+
+from compile_results import get_perplexity
+from get_sentence_scores import sentence_scores
+import results_db
+import token_store
+
+# columns of a score store, one entry per sentence
+COLUMNS = ['setting', 'grammar', 'split', 'subset', 'sent_id', 'score']
+# arrays recording the logs each store was built from, one entry per log
+LOG_COLUMNS = ['log_path', 'log_mtime', 'log_size', 'log_rows']
+
+def results_logs(results_folder):
+    """
+    (setting, path) of the eval-lm logs <grammar>.<split>.<dev|test>.txt in
+    results_folder, whose setting is '', and in its setting subfolders
+    """
+    logs = []
+    for path in sorted(glob.glob(os.path.join(results_folder, '*.txt'))):
+        logs.append(('', path))
+    for path in sorted(glob.glob(os.path.join(results_folder, '*', '*.txt'))):
+        logs.append((os.path.basename(os.path.dirname(path)), path))
+    return [(setting, path) for setting, path in logs
+        if len(os.path.basename(path).split(".")) == 4]
+
+def log_scores(path):
+    """Sentence scores of one eval-lm log as a float64 array"""
+    with open(path, 'r') as log:
+        return np.fromiter(sentence_scores(log), dtype=np.float64)
+
+def log_results(path):
+    """(sentence scores, perplexity or None) of one eval-lm log"""
+    try:
+        perplexity = get_perplexity(path)
+    except (ValueError, IndexError):
+        perplexity = None
+    return log_scores(path), perplexity
+
+def empty_store():
+    return {'setting': np.array([], dtype=str),
+        'grammar': np.array([], dtype=str),
+        'split': np.array([], dtype=np.int32),
+        'subset': np.array([], dtype=str),
+        'sent_id': np.array([], dtype=np.int32),
+        'score': np.array([], dtype=np.float64),
+        'log_path': np.array([], dtype=str),
+        'log_mtime': np.array([], dtype=np.int64),
+        'log_size': np.array([], dtype=np.int64),
+        'log_rows': np.array([], dtype=np.int64)}
+
+def load_store(store_file):
+    """Columns of a score store as a dict of arrays, empty if it is missing"""
+    if not os.path.exists(store_file):
+        return empty_store()
+    with np.load(store_file) as store:
+        return {name: store[name] for name in COLUMNS + LOG_COLUMNS}
+
+def save_store(store_file, store):
+    partial = store_file + ".part"
+    with open(partial, 'wb') as f:
+        np.savez(f, **store)
+    os.replace(partial, store_file)
+
+def ingest(results_folder, store_file, workers=1):
+    """
+    Add the sentence scores of every log in results_folder to store_file,
+    parsing only the logs that are new or changed since the last run.
+    Returns the number of logs parsed
+    """
+    old = load_store(store_file)
+    starts = np.concatenate(([0], np.cumsum(old['log_rows'])))
+    kept = {path: (mtime, size, start, end) for path, mtime, size, start, end
+        in zip(old['log_path'], old['log_mtime'], old['log_size'],
+            starts[:-1], starts[1:])}
+
+    logs = results_logs(results_folder)
+    stats = [os.stat(path) for _, path in logs]
+    stale = [path for (_, path), stat in zip(logs, stats)
+        if kept.get(path, (None, None))[:2]
+            != (stat.st_mtime_ns, stat.st_size)]
+    if workers > 1 and len(stale) > 1:
+        with multiprocessing.Pool(workers) as pool:
+            parsed = dict(zip(stale, pool.map(log_scores, stale)))
+    else:
+        parsed = {path: log_scores(path) for path in stale}
+
+    columns = {name: [] for name in COLUMNS}
+    for (setting, path), stat in zip(logs, stats):
+        if path in parsed:
+            scores = parsed[path]
+        else:
+            _, _, start, end = kept[path]
+            scores = old['score'][start:end]
+        grammar, split, subset, _ = os.path.basename(path).split(".")
+        n = len(scores)
+        columns['setting'].append(np.full(n, setting))
+        columns['grammar'].append(np.full(n, grammar))
+        columns['split'].append(np.full(n, int(split), dtype=np.int32))
+        columns['subset'].append(np.full(n, subset))
+        columns['sent_id'].append(np.arange(n, dtype=np.int32))
+        columns['score'].append(scores)
+
+    store = empty_store()
+    for name, parts in columns.items():
+        if parts:
+            store[name] = np.concatenate(parts)
+    if logs:
+        store['log_path'] = np.array([path for _, path in logs])
+        store['log_mtime'] = np.array([s.st_mtime_ns for s in stats],
+            dtype=np.int64)
+        store['log_size'] = np.array([s.st_size for s in stats],
+            dtype=np.int64)
+        store['log_rows'] = np.array([len(parts) for parts
+            in columns['score']], dtype=np.int64)
+    save_store(store_file, store)
+    return len(stale)
+
+def ingest_database(results_folder, conn, model, workers=1):
+    """
+    Upsert the runs of every log in results_folder that is new or changed
+    into a results database, as runs of model. Returns the number of logs
+    parsed
+    """
+    stamps = results_db.log_stamps(conn, model)
+    logs = results_logs(results_folder)
+    stale = []
+    for setting, path in logs:
+        stat = os.stat(path)
+        if stamps.get(path) != (stat.st_mtime_ns, stat.st_size):
+            stale.append((setting, path, stat))
+    paths = [path for _, path, _ in stale]
+    if workers > 1 and len(stale) > 1:
+        with multiprocessing.Pool(workers) as pool:
+            parsed = pool.map(log_results, paths)
+    else:
+        parsed = [log_results(path) for path in paths]
+
+    with conn:
+        results_db.delete_runs(conn, model,
+            set(stamps) - set(path for _, path in logs))
+        for (setting, path, stat), (scores, perplexity) in zip(stale, parsed):
+            grammar, split, subset, _ = os.path.basename(path).split(".")
+            results_db.upsert_run(conn, model, setting, grammar, int(split),
+                subset, perplexity, scores, path, stat.st_mtime_ns,
+                stat.st_size)
+        results_db.update_perplexities(conn, model)
+    return len(stale)
+
+def parsed_log_tokens(paths, workers=1):
+    """
+    Yield the log_tokens of each path in order. With several workers at
+    most 2 * workers logs are in flight, so memory does not grow with the
+    number of logs
+    """
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield token_store.log_tokens(path)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        pending = collections.deque()
+        for path in paths:
+            pending.append(pool.apply_async(token_store.log_tokens, (path,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def ingest_tokens(results_folder, folder, workers=1):
+    """
+    Write the token log-probabilities of every log in results_folder as a
+    token store in folder, parsing only the logs that are new or changed
+    since the last run and copying the others from the store in folder.
+    Returns the number of logs parsed
+    """
+    logs = results_logs(results_folder)
+    runs = []
+    for setting, path in logs:
+        grammar, split, subset, _ = os.path.basename(path).split(".")
+        stat = os.stat(path)
+        runs.append({'setting': setting, 'grammar': grammar,
+            'split': int(split), 'subset': subset, 'log_path': path,
+            'log_mtime': stat.st_mtime_ns, 'log_size': stat.st_size})
+    stamp = lambda r: (r['log_path'], r['log_mtime'], r['log_size'])
+    old_runs = token_store.load_runs(folder)
+    if [stamp(r) for r in old_runs] == [stamp(r) for r in runs]:
+        return 0
+    kept = {stamp(r): r for r in old_runs}
+    stale = [r['log_path'] for r in runs if stamp(r) not in kept]
+    old = token_store.TokenStore(folder) if kept else None
+
+    def tokens(parsed):
+        """log_tokens of every run, parsed or from the old store, in order"""
+        for r in runs:
+            if stamp(r) in kept:
+                yield token_store.run_tokens(old, kept[stamp(r)])
+            else:
+                yield next(parsed)
+
+    token_store.write_token_store(folder, runs,
+        tokens(parsed_log_tokens(stale, workers)))
+    return len(stale)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Collect the sentence "
+        "scores of all eval-lm logs into one score store per model")
+
+    parser.add_argument("-f", "--results_folders", type=str, nargs='*',
+        default=None, help="Folders of eval-lm logs, such as "
+        "transformer-results/, default every *-results folder")
+
+    parser.add_argument("-O", "--output_folder", type=str, default='',
+        help="Location of the <model>_scores.npz score stores")
+
+    parser.add_argument("-d", "--database", type=str, default='',
+        help="Results database to upsert runs, sentence scores and "
+        "perplexities into")
+
+    parser.add_argument("-t", "--tokens", action='store_true',
+        help="Also write the log-probability of every token as a token "
+        "store <model>_tokens/ in the output folder")
+
+    parser.add_argument("-w", "--workers", type=int, default=1,
+        help="Number of logs parsed at once")
+
+    args = parser.parse_args()
+
+    results_folders = args.results_folders
+    if results_folders is None:
+        results_folders = sorted(f for f in glob.glob('*-results')
+            if os.path.isdir(f))
+    if len(args.output_folder) == 0 and len(args.database) == 0:
+        parser.error("Provide an output folder, a database or both")
+    if len(args.output_folder) > 0:
+        os.makedirs(args.output_folder, exist_ok=True)
+    conn = results_db.connect(args.database) if args.database else None
+    for results_folder in results_folders:
+        model = os.path.basename(os.path.normpath(results_folder))
+        if model.endswith('-results'):
+            model = model[:-len('-results')]
+        if len(args.output_folder) > 0:
+            store_file = os.path.join(args.output_folder,
+                model + "_scores.npz")
+            parsed = ingest(results_folder, store_file, args.workers)
+            print(f"{model}: parsed {parsed} logs into {store_file}")
+        if len(args.output_folder) > 0 and args.tokens:
+            tokens_folder = os.path.join(args.output_folder,
+                model + "_tokens")
+            parsed = ingest_tokens(results_folder, tokens_folder,
+                args.workers)
+            print(f"{model}: parsed {parsed} logs into {tokens_folder}")
+        if conn is not None:
+            parsed = ingest_database(results_folder, conn, model,
+                args.workers)
+            print(f"{model}: parsed {parsed} logs into {args.database}")
@@ -0,0 +1,94 @@
+"""Names and selections of the orderings of a grammar's choice points.
+
+With k choice points there are 2**k orderings. Ordering i flips choice
+point j when bit j - 1 of i is set, and is named by k digits whose jth digit
+is that bit (1 for head-initial, 0 for head-final), so choice points 10 and
+up are simply later positions in the name. Selections are enumerated
+lazily, in order of name, so a stage only touches the orderings it is asked
+for.
+
+A selection is written as one of:
+
+* all                   every ordering
+* sample:N[:SEED]       N orderings drawn at random; the same SEED gives the
+                        same orderings in every stage (default 0)
+* marginal:J=D[,J=D]    every ordering with digit D at choice point J
+* NAME[,NAME]           the orderings with these names
+"""
+import random
+
+
+class OrderingSpace:
+    """The orderings of k choice points"""
+    def __init__(self, k):
+        self.k = k
+
+    def __len__(self):
+        return 2 ** self.k
+
+    def name(self, i):
+        """Name of ordering i"""
+        return format(i, '0' + str(self.k) + 'b')[::-1]
+
+    def index(self, name):
+        """Ordering named name"""
+        if len(name) != self.k or name.strip("01"):
+            raise ValueError(f"{name!r} is not an ordering of {self.k} "
+                "choice points")
+        return int(name[::-1], 2)
+
+    def __iter__(self):
+        return self.marginal({})
+
+    def marginal(self, fixed):
+        """Names of the orderings with digit fixed[j] at each choice point j"""
+        for j, digit in fixed.items():
+            if not 1 <= j <= self.k or digit not in (0, 1):
+                raise ValueError(f"no choice point {j} with digit {digit} "
+                    f"among {self.k} choice points")
+        free = [j for j in range(1, self.k + 1) if j not in fixed]
+        digits = [str(fixed.get(j, 0)) for j in range(1, self.k + 1)]
+        for m in range(2 ** len(free)):
+            for j, d in zip(free, format(m, '0' + str(len(free)) + 'b')):
+                digits[j - 1] = d
+            yield ''.join(digits)
+
+    def sample(self, n, seed=0):
+        """Names of n orderings drawn without replacement"""
+        chosen = random.Random(seed).sample(range(len(self)), min(n, len(self)))
+        return sorted(self.name(i) for i in chosen)
+
+    def select(self, spec):
+        """Names of the orderings in a selection (see the module docstring)"""
+        kind, _, rest = spec.partition(":")
+        if spec == "all":
+            return iter(self)
+        if kind == "sample":
+            n, _, seed = rest.partition(":")
+            return iter(self.sample(int(n), int(seed) if seed else 0))
+        if kind == "marginal":
+            fixed = {}
+            for item in rest.split(","):
+                j, _, digit = item.partition("=")
+                fixed[int(j)] = int(digit)
+            return self.marginal(fixed)
+        names = spec.split(",")
+        for name in names:
+            self.index(name)
+        return iter(names)
+
+
+def add_ordering_arguments(parser, choice_points=6):
+    """Add the -k and --orderings options read by selected_orderings"""
+    parser.add_argument("-k", "--choice_points", type=int,
+        default=choice_points, help="Number of choice points in the grammar")
+
+    parser.add_argument("--orderings", type=str, default="all",
+        help="Orderings to use: all, sample:N[:SEED], marginal:J=D[,J=D] or "
+        "comma-separated names")
+
+
+def selected_orderings(args):
+    """OrderingSpace of args.choice_points and the names args.orderings picks"""
+    space = OrderingSpace(args.choice_points)
+    return space, space.select(args.orderings)
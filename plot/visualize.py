@@ -1,10 +1,14 @@
 """Visualize perplexity scores from fairseq test outputs."""
 import argparse
 import os
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import results_db
+
 def visualize_perplexity(df, output_folder, model_name):
     """Visualize perplexity scores from fairseq test outputs."""
     # NOTE: the csv title should be [setting,div,grammar,perplexity]
@@ -66,10 +70,20 @@ def visualize_perplexity(df, output_folder, model_name):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser('Visualize perplexity scores from fairseq test outputs.')
-    parser.add_argument('--input_file', type=str, required=True, help='input file')
+    parser.add_argument('--input_file', type=str, default='', help='input file')
+    parser.add_argument('--database', type=str, default='', help='results database to read test perplexities from instead')
+    parser.add_argument('--model', type=str, default='transformer', help='model whose perplexities are read from the database')
     parser.add_argument('--output_folder', type=str, required=True, help='output folder', default='vis')
     args = parser.parse_args()
 
-    df = pd.read_csv(args.input_file, dtype={"grammar": str})
-    model_name = args.input_file.split('-')[0]
+    if args.database:
+        rows = results_db.run_perplexities(results_db.connect(args.database), args.model, subset='test')
+        df = pd.DataFrame([(setting, split, grammar, perplexity) for setting, grammar, split, _, perplexity in rows],
+                          columns=['setting', 'div', 'grammar', 'perplexity'])
+        model_name = args.model
+    elif args.input_file:
+        df = pd.read_csv(args.input_file, dtype={"grammar": str})
+        model_name = args.input_file.split('-')[0]
+    else:
+        parser.error('Provide either --input_file or --database')
     visualize_perplexity(df, args.output_folder, model_name)
@@ -5,6 +5,11 @@ import pandas as pd
 import numpy as np
 from statsmodels.regression.mixed_linear_model import MixedLM
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+    os.pardir))
+from score_matrix import ScoreMatrix, has_score_matrix
+import results_db
+
 def read_scores_from_file(filename):
     score_file = open(filename, 'r')
     scores = score_file.readlines()
@@ -13,6 +18,24 @@ def read_scores_from_file(filename):
         indxd_scores.append((i, -1.0*float(scores[i].strip("\n"))))
     return indxd_scores
 
+def read_scores_by_grammar(file_location, scores=None):
+    """(grammar, indexed scores) of every grammar in scores, a dict of
+    arrays, if it is given, and otherwise in file_location, from its score
+    matrix if it has one or else from its score files"""
+    if scores is not None:
+        for grammar in sorted(scores):
+            yield grammar, list(enumerate((-1.0 * scores[grammar]).tolist()))
+        return
+    if has_score_matrix(file_location):
+        matrix = ScoreMatrix(file_location)
+        for grammar in matrix.grammars:
+            yield grammar, list(enumerate((-1.0 * matrix[grammar]).tolist()))
+        return
+    score_files = [os.path.join(file_location, f) for f in os.listdir(
+        os.path.join(file_location)) if f.endswith('.txt')]
+    for f in score_files:
+        yield f.split("/")[-1].split("_")[0], read_scores_from_file(f)
+
 def get_cross_interactions(attribs):
     cross = []
     for i in range(len(attribs)):
@@ -20,17 +43,13 @@ def get_cross_interactions(attribs):
             cross.append(attribs[i] + "_" + attribs[j])
     return cross
 
-def get_dataframe(file_location, output, attribs):
+def get_dataframe(file_location, output, attribs, grammar_scores=None):
     columns = ['sent_id', 'score'] + attribs
     results_df = pd.DataFrame(columns=columns)
     print(results_df.head())
 
-    score_files = [os.path.join(file_location, f) for f in os.listdir(
-        os.path.join(file_location)) if f.endswith('.txt')]
-
-    for f in score_files:
-        scores = read_scores_from_file(f)
-        grammar_name = f.split("/")[-1].split("_")[0]
+    for grammar_name, scores in read_scores_by_grammar(file_location, 
+            grammar_scores):
         attrib_vals = []
         for c in grammar_name:
             if c == '0':
@@ -63,6 +82,18 @@ parser.add_argument("-o", "--output_csv", type=str, default='',
 parser.add_argument("-i", "--include_interactions", type=bool, default=False, 
     help="Whether interaction terms are included")
 
+parser.add_argument("-d", "--database", type=str, default='', 
+    help="Results database to read the scores of all grammars from")
+
+parser.add_argument("--model", type=str, default='transformer', 
+    help="Model whose scores are read from the database")
+
+parser.add_argument("--setting", type=str, default='', 
+    help="Setting whose scores are read from the database")
+
+parser.add_argument("--subset", type=str, default='test', 
+    help="Subset whose scores are read from the database")
+
 args = parser.parse_args()
 
 attribs = ['S','VP','comp', 'PP', 'NP', 'rel']
@@ -75,6 +106,10 @@ elif len(args.file_location) > 0:
         attribs)
 elif len(args.csv_location) > 0:
     results_df = pd.read_csv(args.csv_location)
+elif len(args.database) > 0:
+    results_df = get_dataframe('', args.output_csv, attribs, 
+        results_db.grammar_scores(results_db.connect(args.database), 
+            args.model, args.setting, args.subset))
 else:
     print("Error: Provide either CSV or score files")
     results_df = None
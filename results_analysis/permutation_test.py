@@ -1,84 +1,327 @@
 import argparse
 import os
-import random
 import csv
+import itertools
+import multiprocessing
+import sys
 
-def permutation_test(v1, v2, s):
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+    os.pardir))
+from orderings import add_ordering_arguments, selected_orderings
+from score_matrix import ScoreMatrix, has_score_matrix
+import results_db
+
+def read_scores(file_location, grammar, matrix=None):
+    """Scores of one grammar, from matrix (a ScoreMatrix or a dict of
+    arrays) if one is given"""
+    if matrix is not None:
+        return matrix[grammar]
+    lines = open(os.path.join(file_location, 
+        grammar + "_scores.txt"), 'r').readlines()
+    return [float(l.strip("\n")) for l in lines]
+
+def look_points(s, first=100):
+    """Numbers of permutations at which a sequential test checks its bounds:
+    first, doubling up to s"""
+    looks = []
+    m = first
+    while m < s:
+        looks.append(m)
+        m *= 2
+    return looks + [s]
+
+def kl_bounds(counts, m, radius, steps=50):
+    """
+    Lower and upper Chernoff bounds on p-values estimated as counts/m: the
+    q on either side of counts/m with m * KL(counts/m || q) = radius
+    """
+    p = np.asarray(counts, dtype=np.float64)/m
+    def beyond(q):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kl = (np.where(p > 0, p*np.log(p/q), 0.0)
+                + np.where(p < 1, (1 - p)*np.log((1 - p)/(1 - q)), 0.0))
+        return m*kl > radius
+    # KL(p || q) falls as q rises to p and grows again above it
+    low, high = np.zeros_like(p), p.copy()
+    for _ in range(steps):
+        mid = (low + high)/2
+        out = beyond(mid)
+        low, high = np.where(out, mid, low), np.where(out, high, mid)
+    lower = low
+    low, high = p.copy(), np.ones_like(p)
+    for _ in range(steps):
+        mid = (low + high)/2
+        out = beyond(mid)
+        low, high = np.where(out, low, mid), np.where(out, mid, high)
+    return lower, high
+
+def permutation_test(v1, v2, s, seed=None, max_elements=1 << 22):
+    """
+    Fraction of s random sign flips of the paired differences v1 - v2 whose
+    mean is at least as far from 0 as the observed mean. Flips are drawn as
+    packed random bits, in chunks of at most max_elements signs
+    """
+    return sequential_permutation_test(v1, v2, s, seed=seed,
+        max_elements=max_elements)[0]
+
+def sequential_permutation_test(v1, v2, s, alpha=None, delta=1e-3, 
+        seed=None, max_elements=1 << 22):
+    """
+    (p-value, permutations used) of permutation_test. If alpha is given, the
+    test stops at the first of look_points(s) where the p-value is below or
+    above alpha with probability at least 1 - delta
+    """
     assert(len(v1) == len(v2))
-    diff_av = abs(sum([(v1[i] - v2[i]) for i in range(len(v1))])/len(v1))
+    diff = np.asarray(v1, dtype=np.float64) - np.asarray(v2, dtype=np.float64)
+    n = len(diff)
+    total = diff.sum()
+    diff_av = abs(total/n)
+    rng = np.random.default_rng(seed)
+    chunk = max(1, max_elements // max(n, 1))
+    looks = [s] if alpha is None else look_points(s)
+    radius = np.log(2*len(looks)/delta)
     swapped_av = 0
-    for i in range(s):
-        diff_tot = 0
-        for j in range(len(v1)):
-            diff = v1[j] - v2[j]
-            flip = random.randint(0,1)
-            if flip:
-                diff = -diff
-            diff_tot += diff
-        swapped_diff_av = abs(diff_tot/len(v1))
-        if swapped_diff_av >= diff_av:
-            swapped_av += 1
-    return swapped_av/s
-
-parser = argparse.ArgumentParser(description="Perform permutation tests")
-
-parser.add_argument("-f", "--file_location", type=str, default='', 
-    help="Path to folder containing files")
-
-parser.add_argument("-s", "--number_samples", type=int, default=10000, 
-    help="Number of permutations to sample")
-
-parser.add_argument("-l", "--file_list", type=str, default='', 
-    help="Two files, separated by commas, to compare")
-
-parser.add_argument("-O", "--output_folder", type=str, default='',
-    help="Location of output file")
-
-args = parser.parse_args()
-
-if len(args.file_location) > 0:
-    if len(args.output_folder) > 0:
-        output_file = open(os.path.join(args.output_folder, 
-            'perm_test_results.csv'), 'w')
-        fieldnames = ['Grammar'] + [format(i, '06b') for i in range(64)]
-        writer = csv.DictWriter(output_file, fieldnames=fieldnames)
-        writer.writeheader()
+    done = 0
+    for look in looks:
+        for start in range(done, look, chunk):
+            rows = min(chunk, look - start)
+            packed = rng.integers(0, 256, size=(rows, (n + 7) // 8),
+                dtype=np.uint8)
+            flips = np.unpackbits(packed, axis=1, count=n)
+            # flipping a difference takes it from the total twice
+            swapped_diff_av = np.abs((total - 2 * (flips @ diff))/n)
+            swapped_av += int(np.count_nonzero(swapped_diff_av >= diff_av))
+        done = look
+        if alpha is not None and done < s:
+            lower, upper = kl_bounds(swapped_av, done, radius)
+            if upper < alpha or lower > alpha:
+                break
+    return swapped_av/done, done
+
+def pair_block_counts(scores, block_i, block_j, s, seed, max_elements,
+        alpha=None, delta=1e-3):
+    """
+    Number of the sign flips, shared by all pairs, at which each pair (i, j)
+    with i in block_i, j in block_j and i < j has a flipped mean difference
+    at least as far from 0 as the observed one, and the number of flips
+    drawn for it: s, or fewer where a sequential test with alpha stopped
+    """
+    rows = np.union1d(block_i, block_j)
+    column = {g: c for c, g in enumerate(rows)}
+    block = np.asarray(scores[rows], dtype=np.float64)
+    n = block.shape[1]
+    totals = block.sum(axis=1)
+    pairs = [(i, j) for i in block_i for j in block_j if i < j]
+    ci = np.array([column[i] for i, _ in pairs], dtype=np.int64)
+    cj = np.array([column[j] for _, j in pairs], dtype=np.int64)
+    total = totals[ci] - totals[cj]
+    diff_av = np.abs(total/n)
+    counts = np.zeros(len(pairs), dtype=np.int64)
+    used = np.zeros(len(pairs), dtype=np.int64)
+    active = np.flatnonzero(np.ones(len(pairs), dtype=bool))
+    chunk = max(1, max_elements // max(n, 1))
+    looks = [s] if alpha is None else look_points(s)
+    radius = np.log(2*len(looks)/delta)
+    done = 0
+    for look in looks:
+        # only the grammars of pairs still being tested are flipped
+        live = np.union1d(ci[active], cj[active])
+        position = np.zeros(len(rows), dtype=np.int64)
+        position[live] = np.arange(len(live))
+        for start in range(done, look, chunk):
+            # the flips of each chunk depend only on seed and start, so every
+            # block sees the same ones
+            rng = np.random.default_rng([seed, start])
+            packed = rng.integers(0, 256, size=(min(chunk, look - start),
+                (n + 7) // 8), dtype=np.uint8)
+            flipped = np.unpackbits(packed, axis=1, count=n) @ block[live].T
+            swapped_diff_av = np.abs((total[active] - 2 * (
+                flipped[:, position[ci[active]]]
+                - flipped[:, position[cj[active]]]))/n)
+            counts[active] += np.count_nonzero(
+                swapped_diff_av >= diff_av[active], axis=0)
+            used[active] += len(packed)
+        done = look
+        if alpha is not None and done < s:
+            lower, upper = kl_bounds(counts[active], done, radius)
+            active = active[(upper >= alpha) & (lower <= alpha)]
+            if len(active) == 0:
+                break
+    return pairs, counts, used
+
+# scores shared with worker processes by all_pairs_permutation_test
+_shared_scores = None
+
+def _pair_block_task(task):
+    return pair_block_counts(_shared_scores, *task)
+
+def _share_scores(scores):
+    global _shared_scores
+    _shared_scores = scores
+
+def all_pairs_permutation_test(scores, s, seed=None, workers=1,
+        block_size=16, max_elements=1 << 22, alpha=None, delta=1e-3):
+    """
+    Matrices of the permutation test p-values of every pair of rows of
+    scores, a (grammar x sentence) array, all tested against the same sign
+    flips, and of the number of flips drawn for each pair. Blocks of
+    block_size rows are paired up and spread over workers. With alpha, each
+    pair stops as in sequential_permutation_test
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    blocks = [np.arange(start, min(start + block_size, len(scores)))
+        for start in range(0, len(scores), block_size)]
+    tasks = [(block_i, block_j, s, seed, max_elements, alpha, delta) 
+        for block_i, block_j
+        in itertools.combinations_with_replacement(blocks, 2)]
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=_share_scores,
+                initargs=(scores,)) as pool:
+            results = pool.map(_pair_block_task, tasks)
     else:
-        writer = None
-
-    for i in range(64):
-        grammar_i = format(i, '06b')
-        file_i = open(os.path.join(args.file_location, 
-            grammar_i + "_scores.txt"), 'r')
-        lines_i = file_i.readlines()
-        scores_i = [float(l.strip("\n")) for l in lines_i]
-        i_dict = {"Grammar":grammar_i}
-        for j in range(i+1, 64):
-            grammar_j = format(j, '06b')
-            file_j = open(os.path.join(args.file_location, 
-                grammar_j + "_scores.txt"), 'r')
-            lines_j = file_j.readlines()
-            scores_j = [float(l.strip("\n")) for l in lines_j]
-            if permutation_test(scores_i, scores_j, args.number_samples) < 0.05:
-                if (-1 * sum(scores_j)/len(scores_j) 
-                    > -1 * sum(scores_i)/len(scores_i)):
-                    print("SIGNIFICANT:", grammar_j, ">", grammar_i)
-                    if len(args.output_folder) > 0:
-                        i_dict[grammar_j] = "<"
+        results = [pair_block_counts(scores, *task) for task in tasks]
+    pvalues = np.full((len(scores), len(scores)), np.nan)
+    permutations = np.full((len(scores), len(scores)), np.nan)
+    for pairs, counts, used in results:
+        for (i, j), count, m in zip(pairs, counts, used):
+            pvalues[i, j] = pvalues[j, i] = count/m
+            permutations[i, j] = permutations[j, i] = m
+    return pvalues, permutations
+
+def write_pair_matrix(filename, grammars, values, cast=float):
+    with open(filename, 'w') as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(['Grammar'] + grammars)
+        for grammar, row in zip(grammars, values):
+            writer.writerow([grammar] + ['' if np.isnan(v) else cast(v) 
+                for v in row])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Perform permutation tests")
+
+    parser.add_argument("-f", "--file_location", type=str, default='', 
+        help="Path to folder containing files")
+
+    parser.add_argument("-s", "--number_samples", type=int, default=10000, 
+        help="Number of permutations to sample")
+
+    parser.add_argument("--seed", type=int, default=None, 
+        help="Seed of the random sign flips")
+
+    parser.add_argument("-l", "--file_list", type=str, default='', 
+        help="Two files, separated by commas, to compare")
+
+    parser.add_argument("-O", "--output_folder", type=str, default='',
+        help="Location of output file")
+
+    parser.add_argument("-d", "--database", type=str, default='',
+        help="Results database to read the scores of all grammars from")
+
+    parser.add_argument("--model", type=str, default='transformer',
+        help="Model whose scores are read from the database")
+
+    parser.add_argument("--setting", type=str, default='',
+        help="Setting whose scores are read from the database")
+
+    parser.add_argument("--subset", type=str, default='test',
+        help="Subset whose scores are read from the database")
+
+    parser.add_argument("-a", "--all_pairs", action='store_true',
+        help="Test all pairs at once against shared sign flips, and write "
+        "their p-values to perm_test_pvalues.csv")
+
+    parser.add_argument("-w", "--workers", type=int, default=1,
+        help="Number of processes testing blocks of pairs with --all_pairs")
+
+    parser.add_argument("--block_size", type=int, default=16,
+        help="Number of grammars in a block of pairs with --all_pairs")
+
+    parser.add_argument("--sequential", action='store_true',
+        help="Stop testing a pair once its p-value is known to be below or "
+        "above 0.05, and write the permutations used for each pair to "
+        "perm_test_permutations.csv")
+
+    parser.add_argument("--delta", type=float, default=1e-3,
+        help="Probability that a sequential test stops on the wrong side of "
+        "0.05, for each pair")
+
+    add_ordering_arguments(parser)
+
+    args = parser.parse_args()
+
+    if len(args.file_location) > 0 or len(args.database) > 0:
+        _, grammars = selected_orderings(args)
+        grammars = list(grammars)
+        matrix = None
+        if len(args.database) > 0:
+            matrix = results_db.grammar_scores(results_db.connect(args.database),
+                args.model, args.setting, args.subset)
+        elif has_score_matrix(args.file_location):
+            matrix = ScoreMatrix(args.file_location)
+        if len(args.output_folder) > 0:
+            output_file = open(os.path.join(args.output_folder, 
+                'perm_test_results.csv'), 'w')
+            fieldnames = ['Grammar'] + grammars
+            writer = csv.DictWriter(output_file, fieldnames=fieldnames)
+            writer.writeheader()
+        else:
+            writer = None
+
+        # every grammar's scores are read once
+        scores = np.stack([np.asarray(read_scores(args.file_location, g, matrix),
+            dtype=np.float64) for g in grammars])
+        alpha = 0.05 if args.sequential else None
+        if args.all_pairs:
+            pvalues, permutations = all_pairs_permutation_test(scores, 
+                args.number_samples, args.seed, args.workers, 
+                args.block_size, alpha=alpha, delta=args.delta)
+        else:
+            pvalues = np.full((len(grammars), len(grammars)), np.nan)
+            permutations = np.full((len(grammars), len(grammars)), np.nan)
+            for i, j in itertools.combinations(range(len(grammars)), 2):
+                pvalues[i, j], permutations[i, j] = (
+                    sequential_permutation_test(scores[i], scores[j], 
+                        args.number_samples, alpha, args.delta, args.seed))
+                pvalues[j, i] = pvalues[i, j]
+                permutations[j, i] = permutations[i, j]
+        if len(args.output_folder) > 0 and args.all_pairs:
+            write_pair_matrix(os.path.join(args.output_folder, 
+                'perm_test_pvalues.csv'), grammars, pvalues)
+        if len(args.output_folder) > 0 and args.sequential:
+            write_pair_matrix(os.path.join(args.output_folder, 
+                'perm_test_permutations.csv'), grammars, permutations, int)
+        if args.sequential and len(grammars) > 1:
+            used = permutations[np.triu_indices(len(grammars), 1)]
+            print(f"Permutations per pair: mean {used.mean():.0f}, "
+                f"{np.count_nonzero(used < args.number_samples)} of "
+                f"{len(used)} pairs stopped early")
+        means = scores.mean(axis=1)
+
+        for i, grammar_i in enumerate(grammars):
+            i_dict = {"Grammar":grammar_i}
+            for j, grammar_j in enumerate(grammars[i+1:], i+1):
+                if pvalues[i, j] < 0.05:
+                    if -1 * means[j] > -1 * means[i]:
+                        print("SIGNIFICANT:", grammar_j, ">", grammar_i)
+                        if len(args.output_folder) > 0:
+                            i_dict[grammar_j] = "<"
+                    else:
+                        print("SIGNIFICANT:", grammar_i, ">", grammar_j)
+                        if len(args.output_folder) > 0:
+                            i_dict[grammar_j] = ">"
                 else:
-                    print("SIGNIFICANT:", grammar_i, ">", grammar_j)
                     if len(args.output_folder) > 0:
-                        i_dict[grammar_j] = ">"
-            else:
-                if len(args.output_folder) > 0:
-                    i_dict[grammar_j] = "x"
-        if len(args.output_folder) > 0:
-            writer.write(i_dict)
-elif len(args.file_list) > 0 and len(args.file_list.split(",")) == 2:
-    filename_a = args.file_list.split(",")[0]
-    filename_b = args.file_list.split(",")[1]
-    lines_a = open(filename_a, 'r').readlines()
-    lines_b = open(filename_b, 'r').readlines()
-    scores_a = [float(l.strip("\n")) for l in lines_a]
-    scores_b = [float(l.strip("\n")) for l in lines_b]
-    print(permutation_test(scores_b, scores_b, args.number_samples))
\ No newline at end of file
+                        i_dict[grammar_j] = "x"
+            if len(args.output_folder) > 0:
+                writer.writerow(i_dict)
+    elif len(args.file_list) > 0 and len(args.file_list.split(",")) == 2:
+        filename_a = args.file_list.split(",")[0]
+        filename_b = args.file_list.split(",")[1]
+        lines_a = open(filename_a, 'r').readlines()
+        lines_b = open(filename_b, 'r').readlines()
+        scores_a = [float(l.strip("\n")) for l in lines_a]
+        scores_b = [float(l.strip("\n")) for l in lines_b]
+        print(permutation_test(scores_a, scores_b, args.number_samples, args.seed))
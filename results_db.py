@@ -0,0 +1,157 @@
+"""SQLite store of evaluation results for the analysis scripts.
+
+ingest_scores.py --database fills three tables from the eval-lm logs:
+
+* runs             one row per log: the model, setting, grammar, split and
+                   subset it evaluates, its perplexity and the mtime and size
+                   of the log it was read from
+* sentence_scores  the score of each sentence of a run
+* perplexities     mean and standard deviation over splits of the
+                   perplexity of each (model, setting, grammar, subset)
+
+Runs are keyed by (model, setting, grammar, split, subset), so ingesting a
+log again replaces its rows. The analysis scripts take a slice such as
+setting 1-2, transformer, test with an indexed lookup through the query
+functions below.
+"""
+import math
+import sqlite3
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    model TEXT NOT NULL,
+    setting TEXT NOT NULL,
+    grammar TEXT NOT NULL,
+    split INTEGER NOT NULL,
+    subset TEXT NOT NULL,
+    perplexity REAL,
+    log_path TEXT NOT NULL,
+    log_mtime INTEGER NOT NULL,
+    log_size INTEGER NOT NULL,
+    UNIQUE (model, setting, subset, grammar, split)
+);
+CREATE INDEX IF NOT EXISTS runs_by_log ON runs (log_path);
+CREATE TABLE IF NOT EXISTS sentence_scores (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    sent_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (run_id, sent_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS perplexities (
+    model TEXT NOT NULL,
+    setting TEXT NOT NULL,
+    subset TEXT NOT NULL,
+    grammar TEXT NOT NULL,
+    mean REAL NOT NULL,
+    sd REAL NOT NULL,
+    runs INTEGER NOT NULL,
+    PRIMARY KEY (model, setting, subset, grammar)
+) WITHOUT ROWID;
+"""
+
+
+def connect(path):
+    """Open the results database at path, creating its tables if needed"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def log_stamps(conn, model):
+    """{log path: (mtime, size)} of the runs of model"""
+    return {path: (mtime, size) for path, mtime, size in conn.execute(
+        "SELECT log_path, log_mtime, log_size FROM runs WHERE model = ?",
+        (model,))}
+
+
+def upsert_run(conn, model, setting, grammar, split, subset, perplexity,
+        scores, log_path, log_mtime, log_size):
+    """Insert or replace one run and its sentence scores"""
+    conn.execute("""
+        INSERT INTO runs (model, setting, grammar, split, subset, perplexity,
+            log_path, log_mtime, log_size)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (model, setting, subset, grammar, split) DO UPDATE SET
+            perplexity = excluded.perplexity, log_path = excluded.log_path,
+            log_mtime = excluded.log_mtime, log_size = excluded.log_size""",
+        (model, setting, grammar, split, subset, perplexity, log_path,
+            log_mtime, log_size))
+    run_id = conn.execute("SELECT run_id FROM runs WHERE model = ? AND "
+        "setting = ? AND subset = ? AND grammar = ? AND split = ?",
+        (model, setting, subset, grammar, split)).fetchone()[0]
+    conn.execute("DELETE FROM sentence_scores WHERE run_id = ?", (run_id,))
+    conn.executemany("INSERT INTO sentence_scores (run_id, sent_id, score) "
+        "VALUES (?, ?, ?)", ((run_id, i, float(s))
+            for i, s in enumerate(scores)))
+
+
+def delete_runs(conn, model, log_paths):
+    """Remove the runs of model read from log_paths"""
+    conn.executemany("DELETE FROM runs WHERE model = ? AND log_path = ?",
+        ((model, path) for path in log_paths))
+
+
+def update_perplexities(conn, model):
+    """Recompute the perplexities table for model from its runs"""
+    groups = {}
+    for setting, subset, grammar, perplexity in conn.execute(
+            "SELECT setting, subset, grammar, perplexity FROM runs "
+            "WHERE model = ? AND perplexity IS NOT NULL", (model,)):
+        groups.setdefault((setting, subset, grammar), []).append(perplexity)
+    conn.execute("DELETE FROM perplexities WHERE model = ?", (model,))
+    rows = []
+    for (setting, subset, grammar), values in groups.items():
+        mean = sum(values)/len(values)
+        sd = math.sqrt(sum((x - mean)**2 for x in values)/len(values))
+        rows.append((model, setting, subset, grammar, mean, sd, len(values)))
+    conn.executemany("INSERT INTO perplexities VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows)
+
+
+def run_perplexities(conn, model, setting=None, subset=None):
+    """
+    (setting, grammar, split, subset, perplexity) of the runs of model,
+    restricted to one setting and subset when they are given
+    """
+    query = ("SELECT setting, grammar, split, subset, perplexity FROM runs "
+        "WHERE model = ? AND perplexity IS NOT NULL")
+    params = [model]
+    if setting is not None:
+        query += " AND setting = ?"
+        params.append(setting)
+    if subset is not None:
+        query += " AND subset = ?"
+        params.append(subset)
+    return conn.execute(query + " ORDER BY setting, grammar, split, subset",
+        params).fetchall()
+
+
+def grammar_perplexities(conn, model, setting):
+    """{grammar: {subset: (mean, sd)}} of one model and setting"""
+    result = {}
+    for grammar, subset, mean, sd in conn.execute(
+            "SELECT grammar, subset, mean, sd FROM perplexities "
+            "WHERE model = ? AND setting = ?", (model, setting)):
+        result.setdefault(grammar, {})[subset] = (mean, sd)
+    return result
+
+
+def grammar_scores(conn, model, setting, subset="test"):
+    """
+    {grammar: float64 array} of the sentence scores of one model, setting
+    and subset, with the splits of each grammar in order
+    """
+    scores = {}
+    for grammar, score in conn.execute("""
+            SELECT r.grammar, s.score FROM runs r
+            JOIN sentence_scores s ON s.run_id = r.run_id
+            WHERE r.model = ? AND r.setting = ? AND r.subset = ?
+            ORDER BY r.grammar, r.split, s.sent_id""",
+            (model, setting, subset)):
+        scores.setdefault(grammar, []).append(score)
+    return {g: np.array(s, dtype=np.float64) for g, s in scores.items()}
@@ -0,0 +1,48 @@
+"""Sentence scores of all grammars as one memory-mappable matrix.
+
+combine_sent_scores.py --format npy writes, in its output folder, the scores
+of every grammar as a float64 (grammar x sentence) array in MATRIX_NAME and
+the grammar of each row, one name per line, in GRAMMARS_NAME. Reading the
+matrix maps it instead of parsing it, so a grammar's scores are a row view.
+"""
+import os
+
+import numpy as np
+
+MATRIX_NAME = "scores.npy"
+GRAMMARS_NAME = "grammars.txt"
+
+
+def has_score_matrix(folder):
+    """Whether folder holds a score matrix"""
+    return os.path.exists(os.path.join(folder, MATRIX_NAME))
+
+
+def write_score_matrix(folder, grammars, scores):
+    """Save scores, one row per grammar in grammars, in folder"""
+    scores = np.asarray(scores, dtype=np.float64)
+    if scores.shape[0] != len(grammars):
+        raise ValueError(f"{scores.shape[0]} rows of scores for "
+            f"{len(grammars)} grammars")
+    os.makedirs(folder, exist_ok=True)
+    np.save(os.path.join(folder, MATRIX_NAME), scores)
+    with open(os.path.join(folder, GRAMMARS_NAME), 'w') as f:
+        for grammar in grammars:
+            f.write(grammar + "\n")
+
+
+class ScoreMatrix:
+    """The score matrix saved in a folder, mapped read-only"""
+    def __init__(self, folder):
+        self.scores = np.load(os.path.join(folder, MATRIX_NAME),
+            mmap_mode='r')
+        with open(os.path.join(folder, GRAMMARS_NAME), 'r') as f:
+            self.grammars = [l.strip("\n") for l in f if l.strip()]
+        self.rows = {g: i for i, g in enumerate(self.grammars)}
+
+    def __contains__(self, grammar):
+        return grammar in self.rows
+
+    def __getitem__(self, grammar):
+        """Scores of one grammar"""
+        return self.scores[self.rows[grammar]]
@@ -28,12 +28,22 @@ mkdir -p "sentence_scores_lstm/2-3"
 # - vocab size: 512
 # - tokenizer: sentencepiece
 
-fairseq-preprocess --only-source \
-    --trainpref "data_gen/permuted_splits/base/${GRAMMAR}/${SPLIT}.trn" \
-    --validpref "data_gen/permuted_splits/base/${GRAMMAR}/${SPLIT}.dev" \
-    --testpref "data_gen/permuted_splits/base/${GRAMMAR}/${SPLIT}.tst" \
-    --destdir "data-bin/base/${GRAMMAR}/${SPLIT}-dataset" \
-    --workers 20
+# data_gen/export_binary.py may have written the dataset already; it is
+# rebuilt if the sample file or the split manifest has changed since, from
+# split files written for this grammar and split only
+if [ ! -f "data-bin/base/${GRAMMAR}/${SPLIT}-dataset/train.idx" ] \
+    || [ "data_gen/permuted_samples/sample_${GRAMMAR}.txt" -nt "data-bin/base/${GRAMMAR}/${SPLIT}-dataset/train.idx" ] \
+    || [ "data_gen/permuted_splits/base.json" -nt "data-bin/base/${GRAMMAR}/${SPLIT}-dataset/train.idx" ]; then
+    python data_gen/make_splits.py -S data_gen/permuted_samples \
+        -M data_gen/permuted_splits/base.json --orderings "${GRAMMAR}" \
+        --splits "${SPLIT}" -O data_gen/permuted_splits/base
+    fairseq-preprocess --only-source \
+        --trainpref "data_gen/permuted_splits/base/${GRAMMAR}/${SPLIT}.trn" \
+        --validpref "data_gen/permuted_splits/base/${GRAMMAR}/${SPLIT}.dev" \
+        --testpref "data_gen/permuted_splits/base/${GRAMMAR}/${SPLIT}.tst" \
+        --destdir "data-bin/base/${GRAMMAR}/${SPLIT}-dataset" \
+        --workers 20
+fi
 
 fairseq-train --task language_modeling "data-bin/base/${GRAMMAR}/${SPLIT}-dataset" \
     --save-dir "checkpoints/2-3/${GRAMMAR}/${SPLIT}-lstm" \
@@ -0,0 +1,34 @@
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+DATA_GEN = os.path.join(ROOT, "data_gen")
+# the data_gen stages import each other by module name, as when run from
+# their own folder
+sys.path.insert(0, ROOT)
+sys.path.insert(0, DATA_GEN)
+
+BASE_GRAMMAR = os.path.join(DATA_GEN, "base-grammar.gr")
+
+
+@pytest.fixture(params=[30, 400])
+def sampled(request, tmp_path):
+    """
+    Bracketed lines and an .npz file of the same derivations, sampled with 
+    max_expansions 30, which leaves some nonterminals unexpanded, and 400
+    """
+    from derivations import write_derivations
+    from sample_sentences import PCFG
+
+    grammar = PCFG(BASE_GRAMMAR, random.Random(0))
+    lines = []
+    derivations = []
+    for _ in range(200):
+        lines.append(grammar.sample_sentence(request.param, True))
+        derivations.append(grammar.derivation_rules)
+    npz = tmp_path / "sample.npz"
+    write_derivations(str(npz), grammar, derivations)
+    return lines, str(npz)
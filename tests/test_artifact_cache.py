@@ -0,0 +1,94 @@
+import os
+import time
+
+import pytest
+
+from artifact_cache import files_under, run_cached
+from compressed import open_replacing
+
+
+def stage(text):
+    """A stage replacing its outputs, as the data_gen stages do"""
+    def run(folder):
+        os.makedirs(os.path.join(folder, "sub"), exist_ok=True)
+        for name in ("a.txt", os.path.join("sub", "b.txt")):
+            with open_replacing(os.path.join(folder, name)) as f:
+                f.write(text)
+    return run
+
+
+def cached(tmp_path, inputs, run):
+    return run_cached(str(tmp_path / "cache"), "stage", [], inputs, 
+        {"n": 1}, str(tmp_path / "out"), run)
+
+
+def entry_contents(tmp_path):
+    stage_dir = tmp_path / "cache" / "stage"
+    (entry,) = os.listdir(stage_dir)
+    return {name: (stage_dir / entry / name).read_text() 
+        for name in files_under(str(stage_dir / entry))}
+
+
+def test_rerun_without_cache_leaves_entry_unchanged(tmp_path):
+    sample = tmp_path / "sample.txt"
+    sample.write_text("input\n")
+    assert not cached(tmp_path, [str(sample)], stage("cached\n"))
+    before = entry_contents(tmp_path)
+
+    # a run without --cache_dir writes over the same output folder
+    stage("rewritten\n")(str(tmp_path / "out"))
+    assert (tmp_path / "out" / "a.txt").read_text() == "rewritten\n"
+    assert entry_contents(tmp_path) == before
+
+    # and a later cache hit restores the cached outputs
+    assert cached(tmp_path, [str(sample)], stage("unused\n"))
+    assert (tmp_path / "out" / "a.txt").read_text() == "cached\n"
+    assert (tmp_path / "out" / "sub" / "b.txt").read_text() == "cached\n"
+
+
+def test_changed_input_misses(tmp_path):
+    sample = tmp_path / "sample.txt"
+    sample.write_text("input\n")
+    assert not cached(tmp_path, [str(sample)], stage("first\n"))
+    sample.write_text("changed\n")
+    assert not cached(tmp_path, [str(sample)], stage("second\n"))
+    assert (tmp_path / "out" / "a.txt").read_text() == "second\n"
+
+
+def test_restored_outputs_are_linked_and_newer(tmp_path):
+    sample = tmp_path / "sample.txt"
+    sample.write_text("input\n")
+    cached(tmp_path, [str(sample)], stage("cached\n"))
+    stage_dir = tmp_path / "cache" / "stage"
+    (entry,) = os.listdir(stage_dir)
+    out = tmp_path / "out" / "a.txt"
+    assert os.path.samefile(out, stage_dir / entry / "a.txt")
+    linked = os.stat(out).st_mtime_ns
+    # outputs already linked keep their time
+    cached(tmp_path, [str(sample)], stage("unused\n"))
+    assert os.stat(out).st_mtime_ns == linked
+
+    # a dataset built from other outputs, then the cached ones restored
+    stage("rewritten\n")(str(tmp_path / "out"))
+    built = tmp_path / "train.idx"
+    built.write_text("")
+    time.sleep(0.01)
+    cached(tmp_path, [str(sample)], stage("unused\n"))
+    assert out.read_text() == "cached\n"
+    assert os.stat(out).st_mtime_ns > os.stat(built).st_mtime_ns
+
+
+def test_replacing_keeps_the_old_file_on_error(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("old\n")
+    with pytest.raises(KeyboardInterrupt):
+        with open_replacing(str(path)) as f:
+            f.write("new\n")
+            raise KeyboardInterrupt
+    assert path.read_text() == "old\n"
+    with pytest.raises(KeyboardInterrupt):
+        with open_replacing(str(path), keep=True) as f:
+            f.write("new\n")
+            raise KeyboardInterrupt
+    assert path.read_text() == "new\n"
+    assert os.listdir(tmp_path) == ["a.txt"]
@@ -0,0 +1,58 @@
+import os
+import random
+
+import numpy as np
+import pytest
+
+from conftest import BASE_GRAMMAR
+from derivations import DerivationFile, DerivationWriter
+import permute_sentences
+from permute_sentences import load_derivations, permute_chunk, read_chunks
+from sample_sentences import PCFG
+
+
+def test_bracketed_round_trip(sampled):
+    lines, npz = sampled
+    derivations = DerivationFile(npz)
+    assert len(derivations) == len(lines)
+    for line, (rules, _) in zip(lines, derivations):
+        assert derivations.bracketed(rules) == line.split()
+
+
+def test_permutations_of_text_and_npz_match(sampled, monkeypatch):
+    lines, npz = sampled
+    monkeypatch.setattr(permute_sentences, "_derivations", None)
+    load_derivations(npz)
+    orderings = list(range(64))
+    from_text = permute_chunk([line + "\n" for line in lines], orderings)
+    from_npz = [''] * len(orderings)
+    for chunk in read_chunks(npz, 64):
+        for i, block in enumerate(permute_chunk(chunk, orderings)):
+            from_npz[i] += block
+    assert from_npz == from_text
+
+
+def test_writer_keeps_batches_written_before_an_error(tmp_path):
+    grammar = PCFG(BASE_GRAMMAR, random.Random(2))
+    batches = [[grammar.sample_rules(30) for _ in range(20)] for _ in range(2)]
+    npz = str(tmp_path / "sample.npz")
+    with pytest.raises(KeyboardInterrupt):
+        with DerivationWriter(npz, grammar) as writer:
+            writer.write(batches[0])
+            writer.write(batches[1])
+            raise KeyboardInterrupt
+    derivations = DerivationFile(npz)
+    assert [rules for rules, _ in derivations] == [list(d) 
+        for batch in batches for d in batch]
+    assert sorted(os.listdir(tmp_path)) == ["sample.npz"]
+
+
+def test_arrays_are_mapped_unless_compressed(sampled, tmp_path):
+    lines, npz = sampled
+    derivations = DerivationFile(npz)
+    assert isinstance(derivations.rules, np.memmap)
+    compressed = str(tmp_path / "compressed.npz")
+    np.savez_compressed(compressed, **dict(np.load(npz)))
+    assert [rules for rules, _ in DerivationFile(compressed)] == [rules
+        for rules, _ in derivations]
+    assert len(DerivationFile(compressed)) == len(lines)
@@ -0,0 +1,87 @@
+import struct
+
+import numpy as np
+
+from export_binary import (EOS, INDEX_MAGIC, PADDING_FACTOR, SPECIALS,
+    export_all, write_dataset)
+from make_splits import split_manifest
+
+
+def read_index(path):
+    """(dtype code, sizes, pointers) of an MMapIndexedDataset .idx file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[:len(INDEX_MAGIC)] == INDEX_MAGIC
+    offset = len(INDEX_MAGIC)
+    (version,) = struct.unpack_from("<Q", data, offset)
+    assert version == 1
+    (code,) = struct.unpack_from("<B", data, offset + 8)
+    (n,) = struct.unpack_from("<Q", data, offset + 9)
+    offset += 17
+    sizes = np.frombuffer(data, dtype=np.int32, count=n, offset=offset)
+    pointers = np.frombuffer(data, dtype=np.int64, count=n, 
+        offset=offset + 4 * n)
+    assert offset + 12 * n == len(data)
+    return code, sizes, pointers
+
+
+def test_index_layout(tmp_path):
+    prefix = str(tmp_path / "train")
+    tokens = np.array([5, 6, EOS, 7, EOS, 5, 5, 5, EOS])
+    write_dataset(prefix, tokens, np.array([3, 2, 4]), 16)
+    code, sizes, pointers = read_index(prefix + ".idx")
+    assert code == 8
+    assert sizes.tolist() == [3, 2, 4]
+    # byte offsets of each sentence in the uint16 .bin file
+    assert pointers.tolist() == [0, 6, 10]
+    assert np.fromfile(prefix + ".bin", dtype=np.uint16).tolist() \
+        == tokens.tolist()
+
+
+def test_large_vocabularies_use_uint32(tmp_path):
+    prefix = str(tmp_path / "train")
+    write_dataset(prefix, np.array([70000, EOS]), np.array([2]), 70008)
+    code, _, pointers = read_index(prefix + ".idx")
+    assert code == 9 and pointers.tolist() == [0]
+    assert np.fromfile(prefix + ".bin", dtype=np.uint32).tolist() \
+        == [70000, EOS]
+
+
+def test_export_matches_split_text(tmp_path):
+    lines = ["a b c .", "b a .", "c c b a .", "d a .", "b .", "a a ."] * 5
+    # a second grammar ordering the same words differently
+    grammars = {"000000": lines, "100000": [' '.join(l.split()[-2::-1]) 
+        + " ." for l in lines]}
+    samples = tmp_path / "samples"
+    samples.mkdir()
+    for name, grammar_lines in grammars.items():
+        (samples / ("sample_" + name + ".txt")).write_text(
+            ''.join(l + "\n" for l in grammar_lines))
+    manifest = split_manifest(len(lines), 2, 0.8, 0.1, 0.1)
+    export_all(sorted(str(p) for p in samples.iterdir()), manifest, 
+        str(tmp_path / "bin"))
+
+    subsets = {".trn": "train", ".dev": "valid", ".tst": "test"}
+    for name, grammar_lines in grammars.items():
+        for i, extension, start, end in manifest["files"]:
+            dest = tmp_path / "bin" / name / (str(i) + "-dataset")
+            entries = (dest / "dict.txt").read_text().split("\n")[:-1]
+            symbols = SPECIALS + [e.split(" ")[0] for e in entries]
+            counts = [int(e.split(" ")[1]) for e in entries]
+            assert len(symbols) % PADDING_FACTOR == 0
+            assert counts == sorted(counts, reverse=True)
+
+            prefix = str(dest / subsets[extension])
+            code, sizes, pointers = read_index(prefix + ".idx")
+            tokens = np.fromfile(prefix + ".bin", dtype=np.uint16)
+            assert code == 8 and sizes.sum() == len(tokens)
+            assert pointers.tolist() == (2 * (np.cumsum(sizes) 
+                - sizes)).tolist()
+            decoded = [symbols[t] for t in tokens]
+            expected = [w for l in grammar_lines[start:end] 
+                for w in l.split() + ["</s>"]]
+            # words missing from the training split are <unk>
+            train = {w for l in grammar_lines[manifest["files"][3 * i][2]:
+                manifest["files"][3 * i][3]] for w in l.split()}
+            assert decoded == [w if w in train or w == "</s>" else "<unk>" 
+                for w in expected]
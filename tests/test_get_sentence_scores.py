@@ -0,0 +1,52 @@
+from get_sentence_scores import (sentence_scores, sentence_word_scores,
+    word_score_lines, write_sentence_scores)
+
+HEADER = "2026-01-01 00:00:00 | INFO | fairseq_cli.eval_lm | "
+
+
+def log_line(index, *words):
+    """A word-probability line of fairseq-eval-lm --output-word-probs"""
+    return (HEADER + str(index) + " "
+        + "\t".join(f"{w} [{s:.2f}]" for w, s in words) + "\n")
+
+
+# "a c d </s>" and "e </s>", each spanning two lines, logged out of order
+LOG = [HEADER + "num. model params: 1000\n",
+    log_line(1, ("d", -4), ("</s>", -8), ("e", -16)),
+    log_line(2, ("</s>", -32)),
+    log_line(0, ("a", -1), ("c", -2)),
+    HEADER + "Loss (base 2): 1.0000\n"]
+
+
+def test_sentences_spanning_lines():
+    assert list(sentence_word_scores(LOG)) == [
+        (["a", "c", "d", "</s>"], [-1.0, -2.0, -4.0, -8.0]),
+        (["e", "</s>"], [-16.0, -32.0])]
+    # the old script joined lines with a space, so "c [-2.00] d [-4.00]"
+    # was read as one word scoring -2, giving -11 for the first sentence,
+    # and it lost the second, whose </s> no longer started a word
+    assert list(sentence_scores(LOG)) == [-15.0, -48.0]
+
+
+def test_lines_are_ordered_by_sample_index():
+    assert [fields[0] for fields in word_score_lines(LOG)] == [
+        "a [-1.00]", "d [-4.00]", "</s> [-32.00]"]
+
+
+def test_overflowing_the_pending_lines():
+    # with room for one waiting line, index 0 arrives after 1 and 2 were
+    # emitted, so the words of "a c" come last and end no sentence
+    assert [fields[0] for fields in word_score_lines(LOG, max_pending=1)] == [
+        "d [-4.00]", "</s> [-32.00]", "a [-1.00]"]
+    assert list(sentence_scores(LOG, max_pending=1)) == [-12.0, -48.0]
+    # a missing index does not hold back the lines after it
+    assert list(sentence_scores(LOG[1:3], max_pending=1)) == [-12.0, -48.0]
+    assert list(sentence_scores(LOG[1:3])) == [-12.0, -48.0]
+
+
+def test_write_sentence_scores(tmp_path):
+    log = tmp_path / "000000.0.test.txt"
+    log.write_text(''.join(LOG))
+    write_sentence_scores(str(log), str(tmp_path / "scores"))
+    assert (tmp_path / "scores" / "000000" / "0.test.txt").read_text() == (
+        "-15.0\n-48.0\n")
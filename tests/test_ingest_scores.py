@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+
+from ingest_scores import ingest_tokens
+from token_store import TokenStore
+
+HEADER = "2026-01-01 00:00:00 | INFO | fairseq_cli.eval_lm | "
+
+
+def write_log(path, sentences):
+    """An eval-lm log with one line per sentence of (word, score) pairs"""
+    with open(path, 'w') as f:
+        for i, words in enumerate(sentences):
+            f.write(HEADER + str(i) + " " + "\t".join(f"{w} [{s:.2f}]"
+                for w, s in words + [("</s>", -1.0)]) + "\n")
+
+
+def store_contents(folder):
+    store = TokenStore(str(folder))
+    return {(r['grammar'], r['split']): [
+        (store.words(ids), logprobs.tolist()) for ids, logprobs in
+        (store.sentence(r['grammar'], r['split'], s)
+            for s in range(r['sentences']))] for r in store.runs}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_only_changed_logs_are_parsed(tmp_path, workers):
+    results = tmp_path / "lstm-results"
+    results.mkdir()
+    write_log(results / "000000.0.test.txt", [[("a", -2.0)], [("b", -3.0)]])
+    write_log(results / "000001.0.test.txt", [[("c", -4.0), ("a", -5.0)]])
+    folder = tmp_path / "lstm_tokens"
+    assert ingest_tokens(str(results), str(folder), workers) == 2
+    assert ingest_tokens(str(results), str(folder), workers) == 0
+
+    write_log(results / "000001.0.test.txt", [[("d", -6.0)]])
+    write_log(results / "000002.0.test.txt", [[("a", -7.0)]])
+    os.utime(results / "000001.0.test.txt", ns=(1, 1))
+    assert ingest_tokens(str(results), str(folder), workers) == 2
+    expected = {("000000", 0): [(["a", "</s>"], [-2.0, -1.0]),
+            (["b", "</s>"], [-3.0, -1.0])],
+        ("000001", 0): [(["d", "</s>"], [-6.0, -1.0])],
+        ("000002", 0): [(["a", "</s>"], [-7.0, -1.0])]}
+    assert store_contents(folder) == expected
+
+    # the same as a store built from scratch
+    fresh = tmp_path / "fresh_tokens"
+    assert ingest_tokens(str(results), str(fresh), workers) == 3
+    assert store_contents(fresh) == expected
+    assert sorted(os.listdir(tmp_path)) == ["fresh_tokens", "lstm-results",
+        "lstm_tokens"]
+    assert np.load(folder / "offsets.npy").tolist() == [0, 2, 4, 6, 8]
@@ -0,0 +1,92 @@
+import gzip
+import os
+
+import pytest
+
+from make_splits import create_splits, line_offsets, split_manifest
+
+
+def write_sample(folder, grammar, lines):
+    path = os.path.join(folder, "sample_" + grammar + ".txt")
+    with open(path, 'w') as f:
+        f.write(''.join(line + "\n" for line in lines))
+    return path
+
+
+@pytest.mark.parametrize("num_all_sent, num_splits", [(103, 5), (10, 10), 
+    (7, 1), (1000, 3)])
+def test_split_boundaries(num_all_sent, num_splits):
+    manifest = split_manifest(num_all_sent, num_splits, 0.8, 0.1, 0.1)
+    files = manifest["files"]
+    assert [(i, ext) for i, ext, _, _ in files] == [(i, ext) 
+        for i in range(num_splits) for ext in (".trn", ".tst", ".dev")]
+    # the files tile the sample file without gaps or overlaps
+    assert files[0][2] == 0 and files[-1][3] == num_all_sent
+    for (_, _, _, end), (_, _, start, _) in zip(files, files[1:]):
+        assert end == start
+    for i in range(num_splits):
+        trn, tst, dev = [(s, e) for j, _, s, e in files if j == i]
+        # the boundaries of the original per-split arithmetic
+        start = int(i * (1/num_splits) * num_all_sent)
+        end = int((i+1) * (1/num_splits) * num_all_sent)
+        assert trn[0] == start and dev[1] == end
+        assert trn[1] - start == int(0.8 * (end - start))
+        assert tst[1] - start == int(0.9 * (end - start))
+
+
+def test_create_splits_slices_lines(tmp_path):
+    lines = [f"w{i} x{i % 7} ." for i in range(53)]
+    sample = write_sample(str(tmp_path), "010110", lines)
+    manifest = split_manifest(len(lines), 4, 0.8, 0.1, 0.1)
+    create_splits(sample, manifest, str(tmp_path / "out"))
+    for i, extension, start, end in manifest["files"]:
+        with open(tmp_path / "out" / "010110" / (str(i) + extension)) as f:
+            assert f.read().splitlines() == lines[start:end]
+
+
+def test_seeded_splits_share_an_order(tmp_path):
+    lines = [f"w{i}" for i in range(40)]
+    other_lines = [f"v{i}" for i in range(40)]
+    first = write_sample(str(tmp_path), "000000", lines)
+    second = write_sample(str(tmp_path), "111111", other_lines)
+    manifest = split_manifest(len(lines), 2, 0.8, 0.1, 0.1, seed=3)
+    out = tmp_path / "out"
+    create_splits(first, manifest, str(out))
+    create_splits(second, manifest, str(out))
+    written = []
+    for i, extension, _, _ in manifest["files"]:
+        a = (out / "000000" / (str(i) + extension)).read_text().split()
+        b = (out / "111111" / (str(i) + extension)).read_text().split()
+        # line-aligned sample files stay aligned after shuffling
+        assert [w[1:] for w in a] == [w[1:] for w in b]
+        written += a
+    assert sorted(written) == sorted(lines)
+    assert written != lines
+
+
+def test_line_offsets_without_final_newline():
+    assert line_offsets(b"a b\nc").tolist() == [0, 4, 5]
+    assert line_offsets(b"a b\nc\n").tolist() == [0, 4, 6]
+    assert line_offsets(b"").tolist() == [0]
+
+
+def test_compressed_samples_are_split_as_streams(tmp_path):
+    lines = [f"w{i} x{i % 7} ." for i in range(53)]
+    sample = write_sample(str(tmp_path), "010110", lines)
+    with open(sample, 'rb') as f, gzip.open(sample + ".gz", 'wb') as g:
+        g.write(f.read())
+    for seed in (None, 5):
+        manifest = split_manifest(len(lines), 4, 0.8, 0.1, 0.1, seed=seed)
+        for name, path in (("plain", sample), ("gz", sample + ".gz")):
+            create_splits(path, manifest, str(tmp_path / name), splits=[1, 3])
+        assert sorted(os.listdir(tmp_path / "gz" / "010110")) == sorted(
+            os.listdir(tmp_path / "plain" / "010110"))
+        for name in os.listdir(tmp_path / "plain" / "010110"):
+            assert (tmp_path / "gz" / "010110" / name).read_bytes() == (
+                tmp_path / "plain" / "010110" / name).read_bytes()
+
+    # a sample with the wrong number of lines writes nothing
+    manifest = split_manifest(len(lines) + 1, 4, 0.8, 0.1, 0.1)
+    with pytest.raises(ValueError):
+        create_splits(sample + ".gz", manifest, str(tmp_path / "short"))
+    assert os.listdir(tmp_path / "short" / "010110") == []
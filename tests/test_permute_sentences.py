@@ -0,0 +1,58 @@
+import permute_sentences
+from permute_sentences import (choice_point, load_derivations, permute_chunk,
+    read_chunks)
+
+from orderings import OrderingSpace
+
+
+def parse_tree(tokens):
+    """Bracketed tokens as nested [label, children] lists and words"""
+    stack = [[None, []]]
+    i = 0
+    while i < len(tokens):
+        if tokens[i] == "(":
+            stack.append([tokens[i + 1], []])
+            i += 2
+            continue
+        if tokens[i] == ")":
+            node = stack.pop()
+            stack[-1][1].append(node)
+        else:
+            stack[-1][1].append(tokens[i])
+        i += 1
+    return stack[0][1][0]
+
+
+def flipped_words(node, name):
+    """Words of a tree with the children of every flipped constituent reversed"""
+    if isinstance(node, str):
+        return [node]
+    label, children = node
+    c = choice_point(label)
+    if c and name[c - 1] == "1":
+        children = children[::-1]
+    return [w for child in children for w in flipped_words(child, name)]
+
+
+def test_orderings_match_brute_force_flips(sampled, monkeypatch):
+    lines, npz = sampled
+    space = OrderingSpace(6)
+    orderings = list(range(len(space)))
+    trees = [parse_tree(line.split()) for line in lines]
+    expected = [''.join(' '.join(flipped_words(tree, space.name(i))) + " .\n"
+        for tree in trees) for i in orderings]
+
+    assert permute_chunk([line + "\n" for line in lines], 
+        orderings) == expected
+
+    monkeypatch.setattr(permute_sentences, "_derivations", None)
+    load_derivations(npz)
+    (chunk,) = read_chunks(npz, len(lines))
+    assert permute_chunk(chunk, orderings) == expected
+
+
+def test_selected_orderings(sampled):
+    lines, _ = sampled
+    chunk = [line + "\n" for line in lines]
+    every = permute_chunk(chunk, list(range(64)))
+    assert permute_chunk(chunk, [45, 3]) == [every[45], every[3]]
@@ -0,0 +1,95 @@
+import random
+
+import numpy as np
+import pytest
+
+from conftest import BASE_GRAMMAR
+from derivations import DerivationFile, subtree_ends, write_derivations
+from sample_sentences import PCFG, sample_sentences
+
+# words between and around nonterminals, and a recursive rule that
+# overflows a low max_expansions
+MIXED_GRAMMAR = """\
+1	ROOT	S
+1	S	the A and B .	1
+1	A	A said A	2
+3	A	x
+1	A	y z
+1	B	A A
+1	B	w
+"""
+
+
+@pytest.fixture(params=["base", "mixed"])
+def grammar(request, tmp_path):
+    if request.param == "base":
+        return PCFG(BASE_GRAMMAR, random.Random(0))
+    path = tmp_path / "mixed.gr"
+    path.write_text(MIXED_GRAMMAR)
+    return PCFG(str(path), random.Random(0))
+
+
+def plain_tokens(bracketed):
+    """Words of a bracketed token list, dropping "( label" and ")\""""
+    words = []
+    i = 0
+    while i < len(bracketed):
+        if bracketed[i] == "(":
+            i += 2
+            continue
+        if bracketed[i] != ")":
+            words.append(bracketed[i])
+        i += 1
+    return words
+
+
+@pytest.mark.parametrize("m", [400, 5, 0])
+def test_batch_matches_its_derivations(grammar, tmp_path, m):
+    k = 500
+    rules, ends, offsets = grammar.sample_batch(k, m,
+        np.random.default_rng(1))
+    tokens, token_offsets = grammar.sample_batch_tokens(k, m,
+        np.random.default_rng(1))
+    bracketed = grammar.batch_text(tokens, token_offsets, True)
+    plain = grammar.batch_text(tokens, token_offsets, False)
+    derivations = [rules[start:end].tolist()
+        for start, end in zip(offsets[:-1], offsets[1:])]
+    npz = str(tmp_path / "batch.npz")
+    write_derivations(npz, grammar, derivations)
+    stored = DerivationFile(npz)
+    arity = [sum(grammar.is_nonterminal[t] for t in rhs)
+        for rhs in grammar.rule_rhs]
+    for i, (derivation, line, words) in enumerate(zip(derivations,
+            bracketed.decode().split("\n"), plain.decode().split("\n"))):
+        # at most max_expansions + 1 rules are applied
+        assert sum(rule >= 0 for rule in derivation) <= m + 1
+        assert ends[offsets[i]:offsets[i + 1]].tolist() == subtree_ends(
+            derivation, arity)
+        assert line.split() == stored.bracketed(derivation)
+        assert words.split() == plain_tokens(line.split())
+
+
+def test_batch_follows_the_grammar_distribution(grammar):
+    n = 20000
+    serial = [len(grammar.sample_rules(10)) for _ in range(n)]
+    rules, _, offsets = grammar.sample_batch(n, 10, np.random.default_rng(2))
+    batch = np.diff(offsets)
+    assert abs(batch.mean() - np.mean(serial)) < 0.05 * np.mean(serial)
+    truncated = lambda derivations: np.mean([-1 in d for d in derivations])
+    assert abs(truncated([rules[a:b].tolist() for a, b in
+        zip(offsets[:-1], offsets[1:])]) - truncated([grammar.sample_rules(10)
+        for _ in range(n)])) < 0.02
+
+
+def test_vectorized_streaming_writes_unique_derivations(tmp_path):
+    for binary in (True, False):
+        sample_sentences(BASE_GRAMMAR, 3000, 400, str(tmp_path), True,
+            seed=0, chunk_size=1000, binary=binary, vectorized=True)
+    derivations = DerivationFile(str(tmp_path / "sample_base-grammar.npz"))
+    lines = (tmp_path / "sample_base-grammar.txt").read_text().splitlines()
+    assert len(derivations) == len(lines) == 3000
+    assert len({tuple(rules) for rules, _ in derivations}) == 3000
+    assert len(set(lines)) == 3000
+    # both runs draw chunk i from the same seed
+    assert [derivations.bracketed(rules) for rules, _ in
+        list(derivations)[:100]] == [line.split() for line in lines[:100]]
@@ -0,0 +1,176 @@
+"""Log-probabilities of every token of the eval-lm logs of one model.
+
+ingest_scores.py --tokens writes, for each model, a folder holding:
+
+* logprobs.npy     float32 score of every token, sentence after sentence
+* token_ids.npy    uint16 id of every token, a line of VOCAB_NAME
+* offsets.npy      int64 CSR offsets: the tokens of sentence s are
+                   offsets[s]:offsets[s + 1]
+* runs.json        the logs, in the order their sentences are stored, with
+                   their setting, grammar, split and subset and the index
+                   and number of their first sentence
+* vocab.txt        the word of each token id, one per line
+
+The arrays are memory-mapped when read, so a sentence or a whole run is a
+slice of them.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+from get_sentence_scores import sentence_word_scores
+
+LOGPROBS_NAME = "logprobs.npy"
+TOKEN_IDS_NAME = "token_ids.npy"
+OFFSETS_NAME = "offsets.npy"
+RUNS_NAME = "runs.json"
+VOCAB_NAME = "vocab.txt"
+
+
+def log_tokens(path):
+    """
+    (words, token ids into words, log-probabilities, sentence lengths) of
+    the tokens of one eval-lm log, as compact arrays
+    """
+    vocab = {}
+    ids = []
+    logprobs = []
+    lengths = []
+    with open(path, 'r') as log:
+        for words, scores in sentence_word_scores(log):
+            for w in words:
+                ids.append(vocab.setdefault(w, len(vocab)))
+            logprobs += scores
+            lengths.append(len(words))
+    return (list(vocab), np.array(ids, dtype=np.int64),
+        np.array(logprobs, dtype=np.float32),
+        np.array(lengths, dtype=np.int64))
+
+
+def load_runs(folder):
+    """The runs of the token store in folder, or [] if it has none"""
+    if not os.path.exists(os.path.join(folder, RUNS_NAME)):
+        return []
+    with open(os.path.join(folder, RUNS_NAME), 'r') as f:
+        return json.load(f)
+
+
+def write_token_store(folder, runs, logs, block_size=1 << 20):
+    """
+    Save a token store in folder. runs are dicts with the setting, grammar,
+    split and subset of each log, and logs yields the log_tokens of each
+    log in the same order. Each log is appended to raw files as it arrives,
+    so only one is held in memory, and the finished store replaces folder
+    """
+    partial = folder + ".part"
+    if os.path.exists(partial):
+        shutil.rmtree(partial)
+    os.makedirs(partial)
+    names = {TOKEN_IDS_NAME: np.uint16, LOGPROBS_NAME: np.float32,
+        OFFSETS_NAME: np.int64}
+    raw = {name: open(os.path.join(partial, name + ".raw"), 'wb')
+        for name in names}
+    raw[OFFSETS_NAME].write(np.zeros(1, dtype=np.int64).tobytes())
+    vocab = {}
+    sentence = 0
+    token = 0
+    for run, (words, ids, scores, lengths) in zip(runs, logs):
+        for w in words:
+            vocab.setdefault(w, len(vocab))
+        if len(vocab) > np.iinfo(np.uint16).max + 1:
+            raise ValueError(f"{len(vocab)} words do not fit in uint16 "
+                "token ids")
+        remap = np.array([vocab[w] for w in words], dtype=np.uint16)
+        raw[TOKEN_IDS_NAME].write(remap[ids].tobytes())
+        raw[LOGPROBS_NAME].write(np.asarray(scores, dtype=np.float32)
+            .tobytes())
+        raw[OFFSETS_NAME].write((token + np.cumsum(lengths, dtype=np.int64))
+            .tobytes())
+        run['first_sentence'] = sentence
+        run['sentences'] = len(lengths)
+        sentence += len(lengths)
+        token += len(ids)
+    for f in raw.values():
+        f.close()
+
+    # each raw column becomes an .npy file, copied a block at a time
+    for name, dtype in names.items():
+        n = token if name != OFFSETS_NAME else sentence + 1
+        path = os.path.join(partial, name)
+        values = np.memmap(path + ".raw", dtype=dtype, mode='r', shape=(n,))
+        array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+            shape=(n,))
+        for start in range(0, n, block_size):
+            array[start:start + block_size] = values[start:start + block_size]
+        array.flush()
+        del values, array
+        os.remove(path + ".raw")
+
+    with open(os.path.join(partial, RUNS_NAME), 'w') as f:
+        json.dump(runs, f, indent=1)
+    with open(os.path.join(partial, VOCAB_NAME), 'w') as f:
+        for w in vocab:
+            f.write(w + "\n")
+    # a folder cannot be renamed over another, so the old store is moved
+    # aside first
+    if os.path.exists(folder):
+        old = folder + ".old"
+        os.rename(folder, old)
+        os.rename(partial, folder)
+        shutil.rmtree(old)
+    else:
+        os.rename(partial, folder)
+
+
+def run_tokens(store, run):
+    """
+    log_tokens of one run of a TokenStore, as slices of its mapped arrays
+    """
+    sentences = range(run['first_sentence'],
+        run['first_sentence'] + run['sentences'])
+    tokens = store.token_slice(sentences)
+    lengths = np.diff(store.offsets[sentences.start:sentences.stop + 1])
+    return store.vocab, store.token_ids[tokens], store.logprobs[tokens], \
+        lengths
+
+
+class TokenStore:
+    """The token store saved in a folder, mapped read-only"""
+    def __init__(self, folder):
+        load = lambda name: np.load(os.path.join(folder, name), mmap_mode='r')
+        self.logprobs = load(LOGPROBS_NAME)
+        self.token_ids = load(TOKEN_IDS_NAME)
+        self.offsets = load(OFFSETS_NAME)
+        self.runs = load_runs(folder)
+        with open(os.path.join(folder, VOCAB_NAME), 'r') as f:
+            self.vocab = [l.rstrip("\n") for l in f]
+        self.run_index = {(r['setting'], r['grammar'], r['split'],
+            r['subset']): i for i, r in enumerate(self.runs)}
+
+    def run(self, grammar, split, subset="test", setting=""):
+        """The run of one log, with its first sentence and sentence count"""
+        return self.runs[self.run_index[(setting, grammar, split, subset)]]
+
+    def sentence_range(self, grammar, split, subset="test", setting=""):
+        """Indices of the sentences of one log, as a range"""
+        run = self.run(grammar, split, subset, setting)
+        return range(run['first_sentence'],
+            run['first_sentence'] + run['sentences'])
+
+    def token_slice(self, sentences):
+        """Slice of the token arrays holding a range of sentences"""
+        if len(sentences) == 0:
+            return slice(0, 0)
+        return slice(int(self.offsets[sentences[0]]),
+            int(self.offsets[sentences[-1] + 1]))
+
+    def sentence(self, grammar, split, sent_id, subset="test", setting=""):
+        """(token ids, log-probabilities) of one sentence of a log"""
+        s = self.sentence_range(grammar, split, subset, setting)[sent_id]
+        tokens = slice(int(self.offsets[s]), int(self.offsets[s + 1]))
+        return self.token_ids[tokens], self.logprobs[tokens]
+
+    def words(self, token_ids):
+        return [self.vocab[i] for i in token_ids]